@@ -1,120 +1,326 @@
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, stream_with_context
+import json
+import time
 import os
-from datetime import datetime
-from .stock_news import StockNews
-from .composite import get_composite_score, get_historical
+from datetime import datetime, date
 from dotenv import load_dotenv
 from flask_cors import CORS
-from sqlalchemy import create_engine
 import traceback
-from .db_models import Base 
+from .jobs import JobRunner
+from .cache import response_cache
+from .events import score_events
+from .metrics import HTTP_REQUESTS, HTTP_SECONDS, registry
 from pathlib import Path
+from urllib.parse import urlencode
 
-load_dotenv()
+'''Routes import the pipeline modules when they run - pandas, nltk and SQLAlchemy stay out of import time'''
+api = Blueprint('api', __name__)
 
 BASEDIR = Path(__file__).parent.resolve()
-app = Flask(__name__)
-#app.config['DB_URI'] = f'sqlite:///{BASEDIR}/stock_news.db'
-CORS(app)
 
-engine = create_engine(os.getenv('DATABASE_URL'))
-Base.metadata.create_all(engine)
+def database_url():
+    """Database the app uses unless configured otherwise, read from .env or the environment"""
+    load_dotenv()
+    return os.getenv('DATABASE_URL', f'sqlite:///{BASEDIR}/stock_news.db')
 
-@app.route('/news', methods=['POST'])
+def create_app(config=None):
+    """
+    Build the Flask app, creating the shared engine and schema and the job pool
+    :param config: Dictionary overriding the configuration read from the environment
+    :return: Flask
+    """
+    from .database import init_db
+    from .job_store import JobStore
+
+    app = Flask(__name__)
+    app.config['DB_URI'] = database_url()
+    app.config.update(config or {})
+    CORS(app)
+    app.register_blueprint(api)
+
+    init_db(app.config['DB_URI'])
+
+    '''Background pool for /run-analysis, job status is shared with the other workers through the database'''
+    app.extensions['jobs'] = JobRunner(
+        max_workers=int(os.getenv('JOB_WORKERS', 2)),
+        store=JobStore(app.config['DB_URI'])
+    )
+    return app
+
+@api.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@api.after_app_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def cached_json(build):
+    """
+    Serve a read endpoint from the response cache with ETag and Last-Modified,
+    answering a matching If-None-Match with 304
+    :param build: Callable returning (payload, status) or (payload, status, headers)
+    """
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    payload, status, headers, etag, last_modified = response_cache.get(key, build)
+
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers.update(headers)
+    if etag is None:
+        return response
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@api.route('/news', methods=['POST'])
 def fetch_news():
+    from .stock_news import StockNews
+
     try:
         stocks = request.json.get('stocks', [])
         stock_news = StockNews(
             stocks=stocks,
             wt_key=os.getenv('WT_KEY'),
-            db_uri=app.config['DB_URI']
+            db_uri=current_app.config['DB_URI']
         )
         stock_news.read_rss()
         return jsonify({"status": "success", "message": "News updated"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/summary', methods=['GET'])
+SUMMARY_PAGE_SIZE = 500
+SUMMARY_MAX_PAGE_SIZE = 5000
+
+@api.route('/summary', methods=['GET'])
 def get_summary():
+    from .stock_news import StockNews
+
+    try:
+        stock = request.args.get('stock')
+        stock = stock.upper() if stock else None
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+        cursor = request.args.get('cursor')
+        if cursor:
+            StockNews.decode_cursor(cursor)
+        stream = request.args.get('format') == 'ndjson' or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+        limit = request.args.get('limit', type=int)
+        if limit is None and not stream:
+            limit = SUMMARY_PAGE_SIZE
+        if limit is not None and not 0 < limit <= SUMMARY_MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {SUMMARY_MAX_PAGE_SIZE}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
         stock_news = StockNews(
             stocks=[],
-            db_uri=app.config['DB_URI']
+            db_uri=current_app.config['DB_URI']
         )
-        summary_df = stock_news.get_summary()
-        return jsonify(summary_df.to_dict(orient='records'))
+
+        '''NDJSON - one row per line straight from the database cursor'''
+        if stream:
+            def generate():
+                for row in stock_news.iter_summary(stock, start, end, cursor, limit):
+                    row.pop('_key')
+                    yield json.dumps(row) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        def build():
+            summary_df = stock_news.get_summary(stock, start, end, cursor, limit, verbose=False)
+            headers = {}
+            next_cursor = summary_df.attrs.get('next_cursor')
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+                args = {**request.args.to_dict(), 'cursor': next_cursor}
+                headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+            return summary_df.to_dict(orient='records'), 200, headers
+
+        return cached_json(build)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/composite-score', methods=['GET'])
+@api.route('/composite-score', methods=['GET'])
 def composite_score():
+    from .composite import get_stored_scores
+
+    def build():
+        df = get_stored_scores(db_uri=current_app.config['DB_URI'])
+
+        if df.empty:
+            return {"message": "No composite scores available for today"}, 404
+
+        return {
+            "date": datetime.today().strftime('%Y-%m-%d'),
+            "scores": df.to_dict(orient='records')
+        }, 200
+
+    try:
+        return cached_json(build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/composite-score/intraday', methods=['GET'])
+def intraday_composite_score():
+    '''Not cached - the news weights decay between writes'''
+    from .composite import get_intraday_score
+
+    stocks = request.args.get('stocks')
     try:
-        df = get_composite_score(
-            db_uri=app.config['DB_URI'],
+        df = get_intraday_score(
+            db_uri=current_app.config['DB_URI'],
             fred_key=os.getenv('FRED_KEY'),
-            save=True
+            stocks=[s.strip().upper() for s in stocks.split(',')] if stocks else None
         )
-        
+
         if df.empty:
-            return jsonify({"message": "No composite scores available for today"}), 404
-            
+            return jsonify({"message": "No rolling sentiment available yet"}), 404
+
         return jsonify({
-            "date": datetime.today().strftime('%Y-%m-%d'),
+            "as_of": datetime.utcnow().isoformat(timespec='seconds'),
             "scores": df.to_dict(orient='records')
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/historical-scores', methods=['GET'])
+@api.route('/historical-scores', methods=['GET'])
 def historical_scores():
+    from .composite import get_historical
+
     try:
         days = int(request.args.get('days', 7))
         stock = request.args.get('stock')
     except ValueError:
         return jsonify({"error": "Invalid days parameter"}), 400
     
-    try:
+    def build():
         df = get_historical(
-            db_uri=app.config['DB_URI'], 
+            db_uri=current_app.config['DB_URI'], 
             days=days, stock=stock.upper() if stock else None
         )
-        return jsonify({
+        return {
             "lookback_days": days,
             "scores": df.to_dict(orient='records')
-        })
+        }, 200
+
+    try:
+        return cached_json(build)
     except Exception as e:
-        app.logger.error(f"Historical scores error: {str(e)}")
+        current_app.logger.error(f"Historical scores error: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/run-analysis', methods=['POST'])
+SSE_HEARTBEAT_SECONDS = 15
+'''How often each process checks the database for scores saved by another worker'''
+SSE_POLL_SECONDS = float(os.getenv('SSE_POLL_SECONDS', 2))
+
+@api.route('/stream/scores', methods=['GET'])
+def stream_scores():
+    '''Latest scores on connect unless the client already saw them, then every update.
+    One poller per process publishes saves by other workers, streams only wait on their subscription.'''
+    from .composite import get_latest_score_event
+
+    db_uri = current_app.config['DB_URI']
+    last_seen = request.headers.get('Last-Event-ID', '')
+    score_events.poll(lambda after: get_latest_score_event(db_uri, after=after), SSE_POLL_SECONDS)
+
+    def generate():
+        with score_events.subscribe() as subscription:
+            yield 'retry: 5000\n\n'
+            sent = int(last_seen) if last_seen.isdigit() else 0
+            latest = score_events.latest
+            if latest is not None and latest.id > sent:
+                yield latest.encode()
+                sent = latest.id
+            while True:
+                event = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif event.id > sent:
+                    yield event.encode()
+                    sent = event.id
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api.route('/run-analysis', methods=['POST'])
 def run_full_analysis():
+    from .stock_news import StockNews
+    from .ingest import DEFAULT_STOCKS, MAX_SHARDS, ShardedIngest
+    from .composite import get_composite_score
+
     try:
-        stocks = request.json.get('stocks', ['AAPL','MSFT','NVDA','META','TSLA','AMZN','GOOG'])
-        
-        engine = create_engine(app.config['DB_URI'])
-        Base.metadata.create_all(engine)
-        
-        stock_news = StockNews(
-            stocks=stocks,
-            wt_key=os.getenv('WT_KEY'),
-            db_uri=app.config['DB_URI']
-        )
-        stock_news.read_rss()
-        stock_news.summarize()
-        composite_df = get_composite_score(
-            db_uri=app.config['DB_URI'],
-            fred_key=os.getenv('FRED_KEY'),
-            save=True
-        )
-        
-        return jsonify({
-            "status": "success",
-            "composite_scores": composite_df.to_dict(orient='records')
+        shards = int(request.json.get('shards', os.getenv('INGEST_SHARDS', 1)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "shards must be an integer"}), 400
+
+    try:
+        stocks = request.json.get('stocks', DEFAULT_STOCKS)
+        '''At most INGEST_MAX_SHARDS worker processes'''
+        shards = min(shards, MAX_SHARDS)
+        db_uri = current_app.config['DB_URI']
+        wt_key = os.getenv('WT_KEY')
+        fred_key = os.getenv('FRED_KEY')
+
+        '''Large universes are split across worker processes'''
+        if shards > 1:
+            stock_news = ShardedIngest(
+                stocks=stocks,
+                wt_key=wt_key,
+                db_uri=db_uri,
+                shards=shards
+            )
+        else:
+            stock_news = StockNews(
+                stocks=stocks,
+                wt_key=wt_key,
+                db_uri=db_uri
+            )
+
+        '''Stages run on the job pool, each gets the previous result'''
+        stages = [
+            ('read_rss', lambda _: stock_news.read_rss()),
+            ('summarize', lambda _: stock_news.summarize()),
+            ('composite_score', lambda _: get_composite_score(
+                db_uri=db_uri,
+                fred_key=fred_key,
+                save=True
+            ).to_dict(orient='records'))
+        ]
+        job, created = current_app.extensions['jobs'].submit(tuple(sorted(set(stocks))), stages)
+
+        response = jsonify({
+            "status": "accepted" if created else "running",
+            "job_id": job.id,
+            "job": job.to_dict()
         })
-        
+        response.headers['Location'] = f"/jobs/{job.id}"
+        return response, 202
+
     except Exception as e:
-        app.logger.error(f"Analysis failed: {traceback.format_exc()}")
+        current_app.logger.error(f"Analysis failed: {traceback.format_exc()}")
         return jsonify({"error": str(e)}), 500
 
+@api.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = current_app.extensions['jobs'].get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
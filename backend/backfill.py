@@ -0,0 +1,235 @@
+"""
+Seed news, summaries and prices from archived CSV or JSONL files
+
+    python -m backend.backfill --news headlines.jsonl --prices ohlcv.csv
+
+News records need stock, title, summary and published, guid or link are optional.
+Price records need symbol (or stock), day (or date), open, high, low, close and volume.
+"""
+import argparse
+import csv
+import datetime as dt
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+import pandas as pd
+from sqlalchemy import select, text, update
+from .db_models import News, Summary, PriceBar
+from .database import init_db, session_scope, insert_ignore
+from .batches import open_batch
+from .sentiment import SentimentEngine
+from .stock_news import StockNews
+from .cache import response_cache
+from .metrics import DB_WRITE_SECONDS, ROWS_WRITTEN, timed_stage
+
+def read_records(path):
+    """
+    Stream dictionaries from a .csv or .jsonl/.ndjson file, optionally gzipped
+    :param path: File name
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    name = path[:-3] if path.endswith('.gz') else path
+    with opener(path, 'rt', newline='', encoding='utf-8') as f:
+        if name.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def chunked(records, size):
+    """Lists of up to size records"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _copy_rows(session, model, rows):
+    """
+    Postgres fast path - COPY into a staging table, then move the rows
+    that do not collide with stored keys
+    :return: <int> rows inserted
+    """
+    table = model.__tablename__
+    stage = f'_backfill_{table}'
+    columns = list(rows[0])
+    column_list = ', '.join(columns)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '\\N' if row[c] is None else row[c].isoformat() if isinstance(row[c], (dt.date, dt.datetime)) else row[c]
+            for c in columns
+        ])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table}) ON COMMIT DROP')
+    cursor.execute(f'TRUNCATE {stage}')
+    cursor.copy_expert(f"COPY {stage} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+    result = session.execute(text(
+        f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {stage} ON CONFLICT DO NOTHING'
+    ))
+    return result.rowcount
+
+def bulk_load(session, model, rows):
+    """
+    Insert rows, skipping stored keys. COPY on Postgres, executemany elsewhere,
+    always inside the caller's transaction
+    :return: None
+    """
+    if not rows:
+        return
+    if session.get_bind().dialect.name != 'postgresql':
+        insert_ignore(session, model, rows)
+        return
+
+    with DB_WRITE_SECONDS.time(table=model.__tablename__):
+        written = _copy_rows(session, model, rows)
+    ROWS_WRITTEN.inc(written, table=model.__tablename__)
+
+def price_rows(records, fetched_at):
+    """Normalise price records to price_bars rows"""
+    return [{
+        'symbol': (r.get('symbol') or r.get('stock')).upper(),
+        'day': dt.date.fromisoformat(str(r.get('day') or r.get('date'))[:10]),
+        'open': float(r['open']),
+        'close': float(r['close']),
+        'high': float(r['high']),
+        'low': float(r['low']),
+        'volume': float(r.get('volume') or 0),
+        'fetched_at': fetched_at
+    } for r in records]
+
+def news_rows(records, sentiment, session, batch_id):
+    """
+    Normalise news records to news rows, scoring titles and summaries in one batch
+    :return: list of dictionaries, unique by guid
+    """
+    published = pd.to_datetime(
+        pd.Series([r['published'] for r in records]), utc=True, format='mixed'
+    ).dt.tz_localize(None)
+
+    rows = {}
+    for record, pub_date in zip(records, published.tolist()):
+        stock = record['stock'].upper()
+        guid = record.get('guid') or record.get('link') or hashlib.sha1(
+            f"{record['title']}|{pub_date.isoformat()}".encode('utf-8')
+        ).hexdigest()
+        rows.setdefault(guid, {
+            'guid': guid,
+            'stock': stock,
+            'title': record['title'],
+            'summary': record.get('summary') or '',
+            'published': pub_date,
+            'p_date': f"{stock}_{pub_date.strftime('%Y-%m-%d')}",
+            'batch_id': batch_id
+        })
+    rows = list(rows.values())
+
+    scores = sentiment.score_batch(
+        [row['title'] for row in rows] + [row['summary'] for row in rows],
+        session=session
+    )
+    for i, row in enumerate(rows):
+        row['sentiment_title'] = scores[i]
+        row['sentiment_summary'] = scores[len(rows) + i]
+    return rows
+
+def apply_stored_prices(session, chunk_size=5000):
+    """
+    Check unchecked summaries against stored bars, without calling the price API
+    :return: <int> summaries checked
+    """
+    unchecked = pd.read_sql(
+        select(Summary.id, Summary.stock, Summary.check_day).where(Summary.change == 'UNCHECKED'),
+        session.connection()
+    )
+    if unchecked.empty:
+        return 0
+    unchecked['day'] = pd.to_datetime(unchecked['check_day']).dt.date
+
+    bars = pd.read_sql(
+        select(PriceBar.symbol, PriceBar.day, PriceBar.open, PriceBar.close,
+               PriceBar.high, PriceBar.low, PriceBar.volume)
+        .where(PriceBar.day >= unchecked['day'].min(), PriceBar.day <= unchecked['day'].max()),
+        session.connection()
+    )
+    bars['day'] = pd.to_datetime(bars['day']).dt.date
+
+    checked = unchecked.merge(bars, left_on=['stock', 'day'], right_on=['symbol', 'day'])
+    checked['change'] = (checked['close'] > checked['open']).map({True: 'win', False: 'loss'})
+    rows = checked[['id', 'open', 'close', 'high', 'low', 'volume', 'change']].to_dict(orient='records')
+    for chunk in chunked(rows, chunk_size):
+        session.execute(update(Summary), chunk)
+    return len(rows)
+
+@timed_stage('backfill')
+def backfill(db_uri, news_path=None, prices_path=None, chunk_size=5000,
+             sentiment_processes=None, closing_hour=20, closing_minute=0):
+    """
+    Load archived prices and news in one transaction, then build and check the summaries
+    :param db_uri: Database connection string
+    :param news_path: CSV or JSONL file of headlines
+    :param prices_path: CSV or JSONL file of daily bars
+    :param chunk_size: Records read, scored and written at a time
+    :param sentiment_processes: Worker processes used to score large chunks
+    :return: Dictionary of rows processed, summaries written and summaries checked
+    """
+    engine = init_db(db_uri)
+    now = dt.datetime.utcnow()
+    counts = {'prices': 0, 'news': 0}
+
+    with SentimentEngine(processes=sentiment_processes) as sentiment, session_scope(engine) as session:
+        if prices_path:
+            for chunk in chunked(read_records(prices_path), chunk_size):
+                rows = price_rows(chunk, now)
+                bulk_load(session, PriceBar, rows)
+                counts['prices'] += len(rows)
+            print(f"Processed {counts['prices']} price bars")
+
+        if news_path:
+            batch_id = open_batch(session)
+            for chunk in chunked(read_records(news_path), chunk_size):
+                rows = news_rows(chunk, sentiment, session, batch_id)
+                bulk_load(session, News, rows)
+                counts['news'] += len(rows)
+                print(f"Processed {counts['news']} news")
+
+    '''Summaries pick the new news up through their ingest batch'''
+    counts['summaries'] = StockNews(
+        stocks=[],
+        db_uri=db_uri,
+        closing_hour=closing_hour,
+        closing_minute=closing_minute
+    ).summarize_news()
+    with session_scope(engine) as session:
+        counts['checked'] = apply_stored_prices(session, chunk_size)
+
+    response_cache.invalidate()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--news', help='CSV or JSONL file of headlines')
+    parser.add_argument('--prices', help='CSV or JSONL file of daily OHLCV bars')
+    parser.add_argument('--db-uri', default=os.getenv('DATABASE_URL', 'sqlite:///stock_news.db'))
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--sentiment-processes', type=int)
+    args = parser.parse_args()
+    if not args.news and not args.prices:
+        parser.error('nothing to load, pass --news and/or --prices')
+
+    t0 = time.perf_counter()
+    counts = backfill(args.db_uri, args.news, args.prices, args.chunk_size, args.sentiment_processes)
+    print(f"\nBackfilled {counts} in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Backtest daily news sentiment against the check day's open-to-close move
+
+    python -m backend.backtest --thresholds 0,0.05,0.1,0.2 --windows 1,3,5,10
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from .db_models import Summary
+from .database import get_engine
+
+class History:
+    def __init__(self, stocks, day, sentiment, open_, close):
+        """
+        Checked summaries as columnar arrays, sorted by stock then day
+        :param stocks: array of stock symbols, one per row
+        :param day: datetime64[D] check days
+        :param sentiment: average summary sentiment
+        :param open_: open price on the check day
+        :param close: close price on the check day
+        """
+        self.stocks = stocks
+        self.day = day
+        self.sentiment = sentiment
+        self.ret = close / open_ - 1
+
+        '''Row offsets where each stock's block starts'''
+        self.symbols, self.starts = np.unique(stocks, return_index=True)
+        self.group = np.repeat(np.arange(len(self.symbols)), np.diff(np.append(self.starts, len(stocks))))
+
+    def __len__(self):
+        return len(self.stocks)
+
+def load_history(db_uri, stocks=None):
+    """
+    Load every checked summary with one query
+    :param db_uri: Database connection string
+    :param stocks: Only these stock symbols
+    :return: History
+    """
+    query = select(
+        Summary.stock, Summary.check_day, Summary.sentiment_summary_avg, Summary.open, Summary.close
+    ).where(
+        Summary.change.in_(['win', 'loss']),
+        Summary.open > 0
+    )
+    if stocks:
+        query = query.where(Summary.stock.in_(stocks))
+
+    '''Sorted here, not by the database - a locale collation may order BF.B after BFA,
+    unlike the code point order np.unique groups by'''
+    df = pd.read_sql(query, get_engine(db_uri)).sort_values(['stock', 'check_day'], kind='stable')
+    return History(
+        df['stock'].to_numpy(dtype=object),
+        pd.to_datetime(df['check_day']).to_numpy(dtype='datetime64[D]'),
+        df['sentiment_summary_avg'].to_numpy(dtype=float),
+        df['open'].to_numpy(dtype=float),
+        df['close'].to_numpy(dtype=float)
+    )
+
+def rolling_sentiment(history, windows):
+    """
+    Trailing mean of sentiment over the last w rows of the same stock
+    :param windows: list of window lengths
+    :return: array (windows, rows)
+    """
+    n = len(history)
+    cumsum = np.concatenate([[0.0], np.cumsum(history.sentiment)])
+    idx = np.arange(n)
+    group_start = history.starts[history.group]
+
+    out = np.empty((len(windows), n))
+    for i, w in enumerate(windows):
+        begin = np.maximum(group_start, idx - w + 1)
+        out[i] = (cumsum[idx + 1] - cumsum[begin]) / (idx + 1 - begin)
+    return out
+
+def _pearson(x, y, group, n_groups):
+    """Pearson correlation of x and y within each group"""
+    count = np.bincount(group, minlength=n_groups)
+    sx, sy = np.bincount(group, x, n_groups), np.bincount(group, y, n_groups)
+    sxx, syy = np.bincount(group, x * x, n_groups), np.bincount(group, y * y, n_groups)
+    sxy = np.bincount(group, x * y, n_groups)
+    cov = sxy - sx * sy / np.maximum(count, 1)
+    var = (sxx - sx ** 2 / np.maximum(count, 1)) * (syy - sy ** 2 / np.maximum(count, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(var > 0, cov / np.sqrt(var), np.nan)
+
+def stock_stats(history):
+    """
+    Hit rate and sentiment/return correlation per stock and for the universe
+    :return: DataFrame with one row per stock plus 'ALL'
+    """
+    n_groups = len(history.symbols)
+    signed = np.sign(history.sentiment) != 0
+    hits = (np.sign(history.sentiment) == np.sign(history.ret)) & signed
+
+    group = np.concatenate([history.group, np.full(len(history), n_groups)])
+    x = np.concatenate([history.sentiment, history.sentiment])
+    y = np.concatenate([history.ret, history.ret])
+    days = np.bincount(group, minlength=n_groups + 1)
+    signals = np.bincount(group, np.concatenate([signed, signed]), n_groups + 1)
+    hit_count = np.bincount(group, np.concatenate([hits, hits]), n_groups + 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'stock': list(history.symbols) + ['ALL'],
+            'days': days,
+            'hit_rate': hit_count / signals,
+            'correlation': _pearson(x, y, group, n_groups + 1),
+            'mean_return': np.bincount(group, y, n_groups + 1) / days
+        })
+
+def threshold_grid(history, thresholds, windows):
+    """
+    Long when the trailing sentiment is above a threshold, short when below its negative,
+    for every (window, threshold) pair in one vectorized pass
+    :return: DataFrame with one row per window, threshold and stock, plus 'ALL'
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    signal = rolling_sentiment(history, windows)[:, None, :]            # (W, 1, N)
+    position = np.where(signal > thresholds[None, :, None], 1.0,
+                        np.where(signal < -thresholds[None, :, None], -1.0, 0.0))   # (W, T, N)
+    pnl = position * history.ret
+    trades = position != 0
+    wins = pnl > 0
+
+    '''Sum each stock's contiguous block, then the universe'''
+    per_stock = [np.add.reduceat(a, history.starts, axis=2) for a in (trades, wins, pnl)]
+    totals = [a.sum(axis=2, keepdims=True) for a in (trades, wins, pnl)]
+    trades_s, wins_s, pnl_s = [np.concatenate([s, t], axis=2) for s, t in zip(per_stock, totals)]
+
+    n_w, n_t, n_s = trades_s.shape
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            'window': np.repeat(windows, n_t * n_s),
+            'threshold': np.tile(np.repeat(thresholds, n_s), n_w),
+            'stock': np.tile(list(history.symbols) + ['ALL'], n_w * n_t),
+            'trades': trades_s.ravel().astype(int),
+            'hit_rate': (wins_s / trades_s).ravel(),
+            'mean_return': (pnl_s / trades_s).ravel(),
+            'total_return': pnl_s.ravel()
+        })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-uri', default=os.getenv('DATABASE_URL', 'sqlite:///stock_news.db'))
+    parser.add_argument('--stocks', help='comma separated symbols, default all')
+    parser.add_argument('--thresholds', default='0,0.05,0.1,0.2,0.3')
+    parser.add_argument('--windows', default='1,3,5,10')
+    parser.add_argument('--all-stocks', action='store_true', help='print the grid for every stock, not only ALL')
+    args = parser.parse_args()
+
+    history = load_history(args.db_uri, args.stocks.upper().split(',') if args.stocks else None)
+    if not len(history):
+        print("No checked summaries to backtest")
+        return
+
+    print("\nSentiment vs. open-to-close return:")
+    print(stock_stats(history).to_string(index=False))
+
+    grid = threshold_grid(
+        history,
+        [float(t) for t in args.thresholds.split(',')],
+        [int(w) for w in args.windows.split(',')]
+    )
+    if not args.all_stocks:
+        grid = grid[grid['stock'] == 'ALL']
+    print("\nThreshold strategy:")
+    print(grid.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import datetime as dt
+from sqlalchemy import update
+from .db_models import IngestBatch
+
+def open_batch(session):
+    """
+    Register the news written by the current transaction, they become visible
+    to summaries and rolling sentiment together when it commits
+    :param session: Database session
+    :return: <int> batch id to stamp on the news rows
+    """
+    batch = IngestBatch(created_at=dt.datetime.utcnow())
+    session.add(batch)
+    session.flush()
+    return batch.id
+
+def claim_batches(session, column):
+    """
+    Committed batches a consumer has not handled yet. Ids are not in commit order,
+    so every batch is tracked instead of a high-water mark, and each is claimed with
+    a conditional UPDATE so concurrent runs never handle the same batch twice.
+    :param session: Database session, the claims roll back with it
+    :param column: IngestBatch.summarized_at or IngestBatch.rolled_at
+    :return: list of batch ids claimed
+    """
+    now = dt.datetime.utcnow()
+    candidates = [row[0] for row in session.query(IngestBatch.id).filter(column.is_(None)).order_by(IngestBatch.id)]
+    return [
+        batch_id for batch_id in candidates
+        if session.execute(
+            update(IngestBatch)
+            .where(IngestBatch.id == batch_id, column.is_(None))
+            .values({column.key: now})
+        ).rowcount == 1
+    ]
@@ -0,0 +1,151 @@
+"""
+Offline end-to-end benchmark of the ingest and scoring pipeline
+
+    python -m backend.benchmarks.run --tickers 100 --items 20 --latency-ms 20 --repeats 5
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from .server import StandInConfig, StandInServer
+from sqlalchemy import func
+from .. import fred, sentiment, upstream
+from ..database import session_scope
+from ..db_models import Summary
+from ..stock_news import StockNews
+from ..composite import get_composite_score, get_historical
+
+STAGES = ['read_rss', 'summarize', 'get_composite_score', 'get_historical']
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def timed(fn):
+    """
+    Run fn and measure it, peak memory is only known while tracemalloc is tracing
+    :return: (result, seconds, peak bytes allocated)
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        start_current = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] - start_current if tracing else 0
+    return result, seconds, peak
+
+def run_once(server, symbols, workdir, run_id, fetch_workers):
+    """
+    One full pipeline run against a fresh SQLite database
+    :return: Dictionary of stage -> (rows processed, seconds, peak bytes)
+    """
+    db_uri = f"sqlite:///{os.path.join(workdir, f'bench_{run_id}.db')}"
+    sn = StockNews(stocks=symbols, wt_key='bench', db_uri=db_uri, fetch_workers=fetch_workers)
+    sn.YAHOO_URL = server.base_url + '/rss?s=%s'
+    sn.TRADING_URL = server.base_url + '/history'
+
+    '''Every run scores its texts, not only the first - the scores of earlier runs are in memory'''
+    sentiment.clear_memo()
+
+    results = {}
+    _, seconds, peak = timed(sn.read_rss)
+    results['read_rss'] = (len(symbols) * server.config.items, seconds, peak)
+
+    _, seconds, peak = timed(sn.summarize)
+
+    '''Score the latest past check day, today's session may not have news yet'''
+    with session_scope(sn.engine) as session:
+        results['summarize'] = (session.query(Summary).count(), seconds, peak)
+        latest = session.query(func.max(Summary.check_day))\
+            .filter(Summary.check_day < dt.datetime.combine(dt.date.today(), dt.time()))\
+            .scalar()
+    score_day = latest.date() if latest else dt.date.today()
+    scores, seconds, peak = timed(lambda: get_composite_score(db_uri=db_uri, fred_key='bench', day=score_day))
+    results['get_composite_score'] = (len(scores), seconds, peak)
+
+    history, seconds, peak = timed(lambda: get_historical(db_uri=db_uri, days=365))
+    results['get_historical'] = (len(history), seconds, peak)
+    return results
+
+def run(tickers=50, items=20, days=30, latency_ms=0, repeats=3, fetch_workers=8):
+    """
+    Run the pipeline repeatedly against local stand-ins
+    :return: Dictionary of stage -> metrics
+    """
+    symbols = [f"T{i:04d}" for i in range(tickers)]
+    config = StandInConfig(items=items, days=days, latency_ms=latency_ms)
+    samples = {stage: [] for stage in STAGES}
+    peaks = {}
+
+    fred_url, clients = fred.FRED_URL, upstream.clients()
+    try:
+        with StandInServer(config) as server, tempfile.TemporaryDirectory() as workdir:
+            fred.FRED_URL = server.base_url + '/fred/series/observations'
+
+            '''The stand-ins have no rate limits, measure the pipeline rather than the token buckets'''
+            for service in upstream.SERVICES:
+                upstream.configure(service, rate=None)
+            for run_id in range(repeats):
+                server.hits.clear()
+                for stage, sample in run_once(server, symbols, workdir, run_id, fetch_workers).items():
+                    samples[stage].append(sample)
+
+            '''Memory in a separate traced run, tracemalloc slows everything down'''
+            server.hits.clear()
+            tracemalloc.start()
+            try:
+                for stage, (_, _, peak) in run_once(server, symbols, workdir, 'traced', fetch_workers).items():
+                    peaks[stage] = peak
+            finally:
+                tracemalloc.stop()
+    finally:
+        '''Leave the process as it was, run() is also called from tests and notebooks'''
+        fred.FRED_URL = fred_url
+        upstream.restore_clients(clients)
+
+    report = {}
+    for stage, runs in samples.items():
+        seconds = [s for _, s, _ in runs]
+        rows = sum(r for r, _, _ in runs)
+        report[stage] = {
+            'rows': rows / len(runs),
+            'throughput': rows / sum(seconds) if sum(seconds) else 0.0,
+            'p50_ms': statistics.median(seconds) * 1000,
+            'p99_ms': percentile(seconds, 99) * 1000,
+            'peak_mb': peaks[stage] / 2 ** 20
+        }
+    return report
+
+def print_report(report):
+    print(f"{'stage':<22}{'rows':>10}{'rows/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for stage, m in report.items():
+        print(f"{stage:<22}{m['rows']:>10.0f}{m['throughput']:>12.1f}"
+              f"{m['p50_ms']:>10.1f}{m['p99_ms']:>10.1f}{m['peak_mb']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--items', type=int, default=20, help='RSS entries per ticker')
+    parser.add_argument('--days', type=int, default=30, help='days of history the entries span')
+    parser.add_argument('--latency-ms', type=int, default=0, help='delay added to every upstream response')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    report = run(args.tickers, args.items, args.days, args.latency_ms, args.repeats, args.fetch_workers)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import datetime as dt
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ['surges', 'beats', 'record', 'growth', 'strong', 'plunges', 'misses', 'lawsuit',
+         'weak', 'downgrade', 'steady', 'guidance', 'earnings', 'upgrade', 'concerns', 'rally']
+
+class StandInConfig:
+    def __init__(self, items=20, days=30, latency_ms=0):
+        """
+        :param items: RSS entries per ticker
+        :param days: Days of history the entries and observations span
+        :param latency_ms: Delay added to every response
+        """
+        self.items = items
+        self.days = days
+        self.latency_ms = latency_ms
+
+def rss_feed(symbol, config):
+    """Synthetic Yahoo headline feed, deterministic per symbol"""
+    rng = random.Random(symbol)
+    now = dt.datetime.now(dt.timezone.utc)
+    step = config.days * 24 * 3600 / max(config.items, 1)
+    items = []
+    for i in range(config.items):
+        published = now - dt.timedelta(seconds=step * i + 60)
+        title = f"{symbol} {' '.join(rng.choices(WORDS, k=5))}"
+        summary = ' '.join(rng.choices(WORDS, k=25))
+        items.append(
+            f"<item><guid>{symbol}-{i}</guid><title>{title}</title>"
+            f"<description>{summary}</description>"
+            f"<pubDate>{published.strftime('%a, %d %b %Y %H:%M:%S +0000')}</pubDate></item>"
+        )
+    return ("<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel>"
+            f"<title>{symbol}</title>{''.join(items)}</channel></rss>")
+
+def history(symbol, date_from, date_to):
+    """Synthetic World Trading Data daily bars for weekdays in a range"""
+    rng = random.Random(symbol)
+    bars = {}
+    day = date_from
+    while day <= date_to:
+        if day.weekday() < 5:
+            open_ = 100 + rng.random() * 10
+            close = open_ + rng.uniform(-3, 3)
+            bars[day.isoformat()] = {
+                'open': f"{open_:.2f}", 'close': f"{close:.2f}",
+                'high': f"{max(open_, close) + 1:.2f}", 'low': f"{min(open_, close) - 1:.2f}",
+                'volume': str(rng.randint(10 ** 6, 10 ** 8))
+            }
+        day += dt.timedelta(days=1)
+    return {'symbol': symbol, 'history': bars}
+
+def observations(date_from, date_to):
+    """Synthetic FRED daily observations, '.' on weekends like VIXCLS"""
+    rows = []
+    day = date_from
+    while day <= date_to:
+        value = '.' if day.weekday() >= 5 else f"{15 + (day.toordinal() % 100) / 10:.2f}"
+        rows.append({'date': day.isoformat(), 'value': value})
+        day += dt.timedelta(days=1)
+    return {'observations': rows}
+
+def make_handler(config, hits):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            hits[url.path] = hits.get(url.path, 0) + 1
+            if config.latency_ms:
+                time.sleep(config.latency_ms / 1000)
+
+            if url.path == '/rss':
+                self._send(rss_feed(query['s'], config), 'application/rss+xml')
+            elif url.path == '/history':
+                body = history(query['symbol'], dt.date.fromisoformat(query['date_from']),
+                               dt.date.fromisoformat(query['date_to']))
+                self._send(json.dumps(body), 'application/json')
+            elif url.path == '/fred/series/observations':
+                body = observations(dt.date.fromisoformat(query['observation_start']),
+                                    dt.date.fromisoformat(query['observation_end']))
+                self._send(json.dumps(body), 'application/json')
+            else:
+                self.send_error(404)
+
+        def _send(self, body, content_type):
+            data = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StandInHandler
+
+class StandInServer:
+    """Local stand-in for Yahoo RSS, World Trading Data and FRED"""
+
+    def __init__(self, config=None):
+        self.config = config or StandInConfig()
+        self.hits = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self.config, self.hits))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
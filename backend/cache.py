@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from .metrics import CACHE_REQUESTS
+
+class ResponseCache:
+    def __init__(self, ttl=None):
+        """
+        :param ttl: Seconds an entry is served before it is rebuilt, bounds staleness
+                    when another process wrote the data
+        """
+        self.ttl = ttl if ttl is not None else int(os.getenv('RESPONSE_CACHE_TTL', 30))
+        self._entries = {}
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Return the cached entry for a key, building it on a miss. Last-Modified is the
+        time the payload of the key was first seen with its current ETag, so it moves
+        whenever the data changes, whichever process changed it.
+        :param key: Hashable cache key
+        :param build: Callable returning (payload, status) or (payload, status, headers)
+        :return: (payload, status, headers, etag, last_modified), etag is None for uncached errors
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[5] < self.ttl:
+                CACHE_REQUESTS.inc(cache='response', result='hit')
+                return entry[:5]
+            generation = self._generation
+
+        CACHE_REQUESTS.inc(cache='response', result='miss')
+        payload, status, *extra = build()
+        headers = extra[0] if extra else {}
+        modified = datetime.now(timezone.utc).replace(microsecond=0)
+        if status != 200:
+            return payload, status, headers, None, modified
+
+        body = json.dumps(payload, sort_keys=True, default=str).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            previous = self._versions.get(key)
+            if previous is None:
+                last_modified = modified
+            elif previous[0] == etag:
+                last_modified = previous[1]
+            else:
+                '''Header dates have whole seconds, a change must move it forward'''
+                last_modified = max(modified, previous[1] + timedelta(seconds=1))
+
+            '''An invalidate() during the build means the payload may predate the write'''
+            if generation == self._generation:
+                self._versions[key] = (etag, last_modified)
+                self._entries[key] = (payload, status, headers, etag, last_modified, now)
+        return payload, status, headers, etag, last_modified
+
+    def invalidate(self):
+        """Drop every entry, called whenever stored results change"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    clear = invalidate
+
+'''Shared by the read endpoints and the code that writes their data'''
+response_cache = ResponseCache()
@@ -1,131 +1,120 @@
 import pandas as pd
-import requests
-from datetime import datetime
-from sqlalchemy import create_engine, text
-from .db_models import Base, CompositeScore
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, text
+from .db_models import CompositeScore, DailyScore
+from .rollups import refresh_daily_scores
+from .cache import response_cache
+from .events import Event, event_id, score_events
+from .metrics import ROWS_WRITTEN, timed_stage
+from .database import get_engine, get_session_factory, session_scope
+from .fred import DEFAULT_TTL, refresh_series, get_observations
+from .scoring import score_scenarios
+from .rolling import current_sentiment
 from sqlalchemy.exc import SQLAlchemyError
 
-def get_composite_score(db_uri, fred_key, weights=None, save=True):
+'''Weights'''
+DEFAULT_WEIGHTS = {
+    'sentiment': 0.8,
+    #'interest_rates': 0.2,
+    'vix': 0.2,
+    #'unemployment': 0.05
+}
+
+FRED_SERIES = {
+    #'interest_rates': 'FEDFUNDS',
+    'vix': 'VIXCLS',
+    #'unemployment': 'UNRATE'
+}
+
+def get_fred_value(engine, series_id, fred_key, score_day, fred_ttl=DEFAULT_TTL):
+    """FRED value for a day, the latest close for VIX, served from the local cache"""
+    today = score_day
+    start = today.replace(day=1)
+
+    '''Configure frequency based on series'''
+    params = {}
+    if series_id == 'VIXCLS':
+        params['frequency'] = 'd'
+        start = min(start, today - timedelta(days=7))  # Latest close even early in the month
+    #else:
+        #params['frequency'] = 'm'
+        #params['aggregation_method'] = 'avg'
+
+    '''A failed refresh falls back to the observations already cached'''
+    try:
+        with session_scope(engine) as session:
+            refresh_series(session, series_id, fred_key, start, ttl=fred_ttl, params=params)
+    except Exception as e:
+        print(f"Error refreshing {series_id}, using cached observations: {str(e)}")
+
+    with session_scope(engine) as session:
+        observations = get_observations(session, series_id, start, today)
+
+    '''Get all valid numerical values - none at all is an error, not a VIX of 0.0'''
+    valid_observations = [value for _, value in observations]
+
+    if not valid_observations:
+        raise ValueError(f"No valid numerical data for {series_id} between {start} and {today}")
+
+    '''Return most recent value for daily series, average for monthly'''
+    if series_id == 'VIXCLS':
+        return valid_observations[-1]  # Latest daily value
+    else:
+        return sum(valid_observations)/len(valid_observations)  # Monthly average
+
+def get_macro_data(engine, fred_key, score_day, fred_ttl=DEFAULT_TTL):
+    """
+    Every FRED factor of the composite score for a day
+    :return: Dictionary of factor -> value
+    """
+    return {
+        factor: get_fred_value(engine, series_id, fred_key, score_day, fred_ttl)
+        for factor, series_id in FRED_SERIES.items()
+    }
+
+@timed_stage('composite_score')
+def get_composite_score(db_uri, fred_key, weights=None, save=True, fred_ttl=DEFAULT_TTL, day=None):
     """
     Get composite score using today's sentiment and FRED macro data
     :param db_uri: Database connection string
     :param fred_key: FRED API key
     :param weights: Dictionary of weights for composite score
+    :param fred_ttl: Seconds before cached FRED series are checked for new observations
+    :param day: dt.date to score, defaults to today
     :return: DataFrame with composite scores
     """
 
     '''Weights'''
-    weights = weights or {
-        'sentiment': 0.8,
-        #'interest_rates': 0.2,
-        'vix': 0.2,
-        #'unemployment': 0.05
-    }
+    weights = weights or DEFAULT_WEIGHTS
 
     '''Get sentiment from database'''
-    engine = create_engine(db_uri)
-    Base.metadata.create_all(engine)
-    today = datetime.today().strftime('%Y-%m-%d')
+    engine = get_engine(db_uri)
+    score_day = day or datetime.today().date()
+    today = score_day.strftime('%Y-%m-%d')
+    day_start = datetime.combine(score_day, datetime.min.time())
 
-    query = f"""
+    '''Range on check_day instead of DATE(check_day) so the index is used'''
+    query = text("""
     SELECT stock, sentiment_summary_avg
     FROM summary
-    WHERE DATE(check_day) = '{today}'
-    """
-    sentiment_df = pd.read_sql(query, engine)
+    WHERE check_day >= :day_start AND check_day < :day_end
+    """)
+    sentiment_df = pd.read_sql(query, engine, params={
+        'day_start': day_start,
+        'day_end': day_start + timedelta(days=1)
+    })
 
     if sentiment_df.empty:
-        print("No sentiment data for today")
+        print(f"No sentiment data for {today}")
         return pd.DataFrame()
 
     '''Get FRED data'''
-    fred_series = {
-        #'interest_rates': 'FEDFUNDS',
-        'vix': 'VIXCLS',
-        #'unemployment': 'UNRATE'
-    }
-
-    def get_fred_value(series_id):
-      """Helper to get FRED data with daily values for VIX"""
-      today = datetime.today()
-      start = today.replace(day=1).strftime('%Y-%m-%d')
-      end = today.strftime('%Y-%m-%d')
-
-      params = {
-          'series_id': series_id,
-          'api_key': fred_key,
-          'file_type': 'json',
-          'observation_start': start,
-          'observation_end': end,
-      }
-
-      '''Configure frequency based on series'''
-      if series_id == 'VIXCLS':
-          params['frequency'] = 'd'
-      #else:
-          #params['frequency'] = 'm'
-          #params['aggregation_method'] = 'avg'
-
-      try:
-          response = requests.get('https://api.stlouisfed.org/fred/series/observations', params=params)
-          response.raise_for_status()
-          data = response.json()
-
-          if not data.get('observations'):
-              print(f"No data found for {series_id} between {start} and {end}")
-              return 0.0
-
-          '''Get all valid numerical values (skip '.' and empty strings)'''
-          valid_observations = [
-              float(obs['value'])
-              for obs in data['observations']
-              if obs['value'] not in {'.', ''}
-          ]
-
-          if not valid_observations:
-              print(f"No valid numerical data for {series_id}")
-              return 0.0
-
-          '''Return most recent value for daily series, average for monthly'''
-          if series_id == 'VIXCLS':
-              return valid_observations[-1]  # Latest daily value
-          else:
-              return sum(valid_observations)/len(valid_observations)  # Monthly average
-
-      except Exception as e:
-          print(f"Error getting {series_id}: {str(e)}")
-          return 0.0
-
-    '''Get all FRED values'''
-    macro_data = {
-        #'interest_rates': get_fred_value(fred_series['interest_rates']),
-        'vix': get_fred_value(fred_series['vix']),
-        #'unemployment': get_fred_value(fred_series['unemployment'])
-    }
+    macro_data = get_macro_data(engine, fred_key, score_day, fred_ttl)
 
     '''Calculate composite score'''
-    composite_scores = []
-    for _, row in sentiment_df.iterrows():
-        normalised_sentiment = (row['sentiment_summary_avg'] + 1) / 2 * 100
-        vix_value = macro_data['vix']
-        normalised_vix = max(0, min(100, (vix_value - 10) / (80 - 10) * 100))
-        score = (
-            normalised_sentiment * weights['sentiment'] +
-            normalised_vix * weights['vix']
-            #row['sentiment_summary_avg'] * weights['sentiment'] +
-            #macro_data['interest_rates'] * weights['interest_rates'] +
-            #macro_data['vix'] * weights['vix'] +
-            #macro_data['unemployment'] * weights['unemployment']
-        )
-        final_score = max(0, min(100, score))
-        composite_scores.append({
-            'stock': row['stock'],
-            'date': today,
-            'sentiment': row['sentiment_summary_avg'],
-            **macro_data,
-            'composite_score': final_score
-        })
-    composite_df = pd.DataFrame(composite_scores)
+    sentiment_df = sentiment_df.rename(columns={'sentiment_summary_avg': 'sentiment'}).assign(date=today)
+    macro_df = pd.DataFrame([{'date': today, **macro_data}])
+    composite_df = score_scenarios(sentiment_df, macro_df, weights)
     grouped_df = composite_df.groupby('stock').agg({
         'date': 'first',
         'vix': 'first',
@@ -134,21 +123,56 @@ def get_composite_score(db_uri, fred_key, weights=None, save=True):
     }).reset_index()
 
     if save and not grouped_df.empty:
-        save_composite_score(db_uri, grouped_df)
+        save_composite_score(db_uri, grouped_df, day=score_day)
+
+    return grouped_df
+
+@timed_stage('intraday_score')
+def get_intraday_score(db_uri, fred_key, weights=None, fred_ttl=DEFAULT_TTL, now=None, stocks=None):
+    """
+    Composite score from the time-decayed rolling sentiment, read at any time of day
+    without rescanning news or summaries
+    :param db_uri: Database connection string
+    :param fred_key: FRED API key
+    :param weights: Dictionary of weights for composite score
+    :param fred_ttl: Seconds before cached FRED series are checked for new observations
+    :param now: datetime the sentiment is decayed to, defaults to utcnow
+    :param stocks: Only these stocks, None for all
+    :return: DataFrame with composite scores, the decayed news weight and the newest headline time
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    engine = get_engine(db_uri)
+    now = now or datetime.utcnow()
+    today = now.strftime('%Y-%m-%d')
+
+    with session_scope(engine) as session:
+        sentiment_df = current_sentiment(session, now=now, stocks=stocks)
+
+    if sentiment_df.empty:
+        print("No rolling sentiment yet")
+        return pd.DataFrame()
 
+    macro_df = pd.DataFrame([{'date': today, **get_macro_data(engine, fred_key, now.date(), fred_ttl)}])
+    composite_df = score_scenarios(sentiment_df[['stock', 'sentiment']].assign(date=today), macro_df, weights)
+    grouped_df = composite_df.groupby('stock').agg({
+        'date': 'first',
+        'vix': 'first',
+        'sentiment': 'mean',
+        'composite_score': 'mean'
+    }).reset_index()
+
+    freshness = sentiment_df[['stock', 'weight', 'news', 'as_of']]
+    grouped_df = grouped_df.merge(freshness.assign(as_of=freshness['as_of'].astype(str)), on='stock')
     return grouped_df
 
-def save_composite_score(db_uri, composite_df):
-    """Save composite scores to database"""
-    from sqlalchemy.orm import sessionmaker
-    
-    engine = create_engine(db_uri)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    
+def save_composite_score(db_uri, composite_df, day=None):
+    """Save composite scores to database, for today unless another dt.date is given"""
+    Session = get_session_factory(get_engine(db_uri))
+    session = Session()
+
     try:
-        session = Session()
-        today = datetime.today().date()
+        today = day or datetime.today().date()
+        saved_at = datetime.utcnow()
         
         '''Delete existing entries for today - prevent duplicates'''
         session.query(CompositeScore)\
@@ -157,17 +181,30 @@ def save_composite_score(db_uri, composite_df):
             
         '''Convert DataFrame to database objects'''
         records = []
+        scores = []
         for _, row in composite_df.iterrows():
             records.append(CompositeScore(
                 stock=row['stock'],
                 date=today,
                 sentiment=row['sentiment'],
                 vix=row['vix'],
-                composite_score=row['composite_score']
+                composite_score=row['composite_score'],
+                saved_at=saved_at
             ))
+            scores.append(_score_payload(row, today))
         
         session.add_all(records)
+        session.flush()
+
+        '''Keep the daily rollup in step with today's scores, it outlives composite_scores under retention'''
+        refresh_daily_scores(session, [today])
         session.commit()
+        response_cache.invalidate()
+        ROWS_WRITTEN.inc(len(records), table='composite_scores')
+
+        '''Push the new scores to this process' /stream/scores subscribers, the other
+        workers' streams find them by saved_at'''
+        score_events.publish('scores', {'date': today.isoformat(), 'scores': scores}, id=event_id(saved_at))
         print(f"Saved {len(records)} composite scores for {today}")
         
     except Exception as e:
@@ -176,30 +213,80 @@ def save_composite_score(db_uri, composite_df):
     finally:
         session.close()
 
+def _score_payload(row, day):
+    return {
+        'stock': row['stock'],
+        'date': day.isoformat(),
+        'sentiment': float(row['sentiment']),
+        'vix': float(row['vix']),
+        'composite_score': float(row['composite_score'])
+    }
+
+def get_latest_score_event(db_uri, after=0):
+    """
+    The scores of the most recent save by any process, as the event it published
+    :param db_uri: Database connection string
+    :param after: Only if its id is above this event id
+    :return: Event or None
+    """
+    with session_scope(get_engine(db_uri)) as session:
+        saved_at = session.query(func.max(CompositeScore.saved_at)).scalar()
+        if saved_at is None or event_id(saved_at) <= after:
+            return None
+
+        rows = session.query(CompositeScore).filter(CompositeScore.saved_at == saved_at)\
+            .order_by(CompositeScore.stock).all()
+        day = rows[0].date
+        scores = [_score_payload(vars(row), day) for row in rows]
+    return Event(event_id(saved_at), 'scores', {'date': day.isoformat(), 'scores': scores})
+
+@timed_stage('historical')
 def get_historical(db_uri, days=30, stock=None):
-    """Retrieve historical composite scores with daily averages"""
-    engine = create_engine(db_uri)
-    
-    base_query = """
-        SELECT 
-            stock,
-            date,
-            AVG(sentiment) as sentiment,
-            AVG(composite_score) as composite_score,
-            AVG(vix) as vix
-        FROM composite_scores
-        WHERE date >= date('now', '-%d days')
-    """ % days
-    
+    """Retrieve historical composite scores with daily averages from the daily rollup"""
+    engine = get_engine(db_uri)
+    since = datetime.today().date() - timedelta(days=days)
+
+    query = select(
+        DailyScore.stock,
+        DailyScore.date,
+        DailyScore.sentiment,
+        DailyScore.composite_score,
+        DailyScore.vix
+    ).where(DailyScore.date >= since)
+
     if stock:
-        base_query += f" AND stock = '{stock}'"
-    
-    base_query += """
-        GROUP BY stock, date
-        ORDER BY date DESC, stock
+        query = query.where(DailyScore.stock == stock)
+
+    query = query.order_by(DailyScore.date.desc(), DailyScore.stock)
+
+    try:
+        df = pd.read_sql(query, engine)
+    except SQLAlchemyError as e:
+        raise RuntimeError(f"Database error: {str(e)}") from e
+    df['date'] = df['date'].astype(str)
+    return df
+
+def get_stored_scores(db_uri, day=None):
     """
-    
+    Composite scores already saved for a day, without recomputing them
+    :param db_uri: Database connection string
+    :param day: dt.date, defaults to today
+    :return: DataFrame with the same columns as get_composite_score
+    """
+    engine = get_engine(db_uri)
+    day = day or datetime.today().date()
+
+    query = select(
+        CompositeScore.stock,
+        CompositeScore.date,
+        CompositeScore.vix,
+        CompositeScore.sentiment,
+        CompositeScore.composite_score
+    ).where(CompositeScore.date == day).order_by(CompositeScore.stock)
+
     try:
-        return pd.read_sql(base_query, engine)
+        df = pd.read_sql(query, engine)
     except SQLAlchemyError as e:
-        raise RuntimeError(f"Database error: {str(e)}") from e
\ No newline at end of file
+        raise RuntimeError(f"Database error: {str(e)}") from e
+    df['date'] = df['date'].astype(str)
+    return df
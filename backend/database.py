@@ -1,18 +1,93 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import os
+import threading
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from contextlib import contextmanager
-from .db_models import Base
+from .migrations import upgrade
+from .metrics import DB_WRITE_SECONDS, ROWS_WRITTEN
+
+'''One engine and session factory per database URI for the whole process'''
+_engines = {}
+_session_factories = {}
+_migrated = set()
+_lock = threading.Lock()
+
+def get_engine(db_uri):
+    """
+    Return the shared engine for a URI, the schema is left as it is, see init_db
+    :param db_uri: Database connection string
+    :return: Engine
+    """
+    engine = _engines.get(db_uri)
+    if engine is not None:
+        return engine
+
+    with _lock:
+        if db_uri not in _engines:
+            kwargs = {'pool_pre_ping': True}
+            url = make_url(db_uri)
+            if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+                '''One in-memory database for every thread, e.g. the job pool, not one per connection'''
+                kwargs['poolclass'] = StaticPool
+                kwargs['connect_args'] = {'check_same_thread': False}
+            elif url.get_backend_name() == 'sqlite':
+                '''Seconds a writer waits for another process' transaction, e.g. a shard'''
+                kwargs['connect_args'] = {'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 30))}
+            else:
+                kwargs['pool_size'] = int(os.getenv('DB_POOL_SIZE', 5))
+                kwargs['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+                kwargs['pool_recycle'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+            _engines[db_uri] = create_engine(db_uri, **kwargs)
+        return _engines[db_uri]
 
 def init_db(db_uri):
-    engine = create_engine(db_uri)
-    Base.metadata.create_all(engine)
+    """
+    Shared engine for a URI with the schema brought up to date, once per process.
+    Entry points call this, library code that only reads and writes uses get_engine.
+    :param db_uri: Database connection string
+    :return: Engine
+    """
+    engine = get_engine(db_uri)
+    if db_uri in _migrated:
+        return engine
+
+    with _lock:
+        if db_uri not in _migrated:
+            upgrade(engine)
+            _migrated.add(db_uri)
     return engine
 
+def dispose_engines():
+    """
+    Forget the engines inherited from a parent process, call first in a forked worker
+    so it opens its own connections instead of sharing the parent's sockets
+    """
+    global _lock
+    _lock = threading.Lock()
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+    _session_factories.clear()
+
+def get_session_factory(engine):
+    """
+    Return the shared session factory of an engine
+    :param engine: Engine
+    :return: sessionmaker
+    """
+    factory = _session_factories.get(engine)
+    if factory is None:
+        with _lock:
+            factory = _session_factories.setdefault(engine, sessionmaker(bind=engine))
+    return factory
+
 @contextmanager
 def session_scope(engine):
     """Provide a transactional scope around a series of operations."""
-    Session = scoped_session(sessionmaker(bind=engine))
-    session = Session()
+    session = get_session_factory(engine)()
     try:
         yield session
         session.commit()
@@ -20,4 +95,51 @@ def session_scope(engine):
         session.rollback()
         raise
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def existing_keys(session, column, keys, chunk_size=500):
+    """
+    Return the subset of keys already stored in a column, one IN query per chunk
+    :param session: Database session
+    :param column: Mapped column, e.g. News.guid
+    :param keys: iterable of key values
+    :param chunk_size: keys per query, keeps SQLite under its bound parameter limit
+    :return: set
+    """
+    keys = list(keys)
+    found = set()
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        found.update(row[0] for row in session.query(column).filter(column.in_(chunk)))
+    return found
+
+def insert_ignore(session, model, rows):
+    """
+    Bulk insert rows, skipping any that collide with an existing primary key
+    :param session: Database session
+    :param model: Mapped class
+    :param rows: list of dictionaries
+    :return: None
+    """
+    if not rows:
+        return
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        stmt = sqlite.insert(model).on_conflict_do_nothing()
+    elif dialect == 'postgresql':
+        stmt = postgresql.insert(model).on_conflict_do_nothing()
+    else:
+        '''No portable ON CONFLICT - filter out existing keys first'''
+        pk = model.__table__.primary_key.columns.values()[0]
+        taken = existing_keys(session, pk, [row[pk.key] for row in rows])
+        rows = [row for row in rows if row[pk.key] not in taken]
+        if not rows:
+            return
+        stmt = insert(model)
+
+    table = model.__tablename__
+    with DB_WRITE_SECONDS.time(table=table):
+        result = session.execute(stmt, rows)
+    written = getattr(result, 'rowcount', -1)
+    ROWS_WRITTEN.inc(written if written >= 0 else len(rows), table=table)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Integer, UniqueConstraint, Date
+from sqlalchemy import Column, String, Float, DateTime, Integer, UniqueConstraint, Date, Index, Text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -13,6 +13,45 @@ class News(Base):
     p_date = Column(String)
     sentiment_summary = Column(Float)
     sentiment_title = Column(Float)
+    batch_id = Column(Integer)
+
+    __table_args__ = (
+        Index('ix_news_p_date', 'p_date'),
+        Index('ix_news_batch_id', 'batch_id'),
+        Index('ix_news_stock_published', 'stock', 'published'),
+    )
+
+class IngestBatch(Base):
+    __tablename__ = 'ingest_batches'
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime)
+    summarized_at = Column(DateTime)
+    rolled_at = Column(DateTime)
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+    name = Column(String, primary_key=True)
+    watermark = Column(DateTime)
+
+class SentimentScore(Base):
+    __tablename__ = 'sentiment_scores'
+    text_hash = Column(String, primary_key=True)
+    compound = Column(Float)
+
+class RollingSentiment(Base):
+    __tablename__ = 'rolling_sentiment'
+    stock = Column(String, primary_key=True)
+    total = Column(Float)
+    weight = Column(Float)
+    news = Column(Integer)
+    as_of = Column(DateTime)
+
+class FeedState(Base):
+    __tablename__ = 'feed_state'
+    stock = Column(String, primary_key=True)
+    etag = Column(String)
+    modified = Column(String)
+    checked_at = Column(DateTime)
 
 class Summary(Base):
     __tablename__ = 'summary'
@@ -31,6 +70,30 @@ class Summary(Base):
     sentiment_title_avg = Column(Float)
     sentiment_title_med = Column(Float)
 
+    __table_args__ = (
+        Index('ix_summary_check_day', 'check_day'),
+        Index('ix_summary_change_check_day', 'change', 'check_day'),
+        Index('ix_summary_stock_check_day', 'stock', 'check_day'),
+    )
+
+class PriceBar(Base):
+    __tablename__ = 'price_bars'
+    symbol = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    open = Column(Float)
+    close = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    volume = Column(Float)
+    fetched_at = Column(DateTime)
+
+class FredObservation(Base):
+    __tablename__ = 'fred_observations'
+    series_id = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    value = Column(Float)
+    fetched_at = Column(DateTime)
+
 class CompositeScore(Base):
     __tablename__ = 'composite_scores'
     
@@ -40,6 +103,47 @@ class CompositeScore(Base):
     sentiment = Column(Float)
     vix = Column(Float)
     composite_score = Column(Float)
-    
+    '''UTC time of the save that wrote the row, streams of every worker poll for newer ones'''
+    saved_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('uq_composite_scores_stock_date', 'stock', 'date', unique=True),
+        Index('ix_composite_scores_date', 'date'),
+        Index('ix_composite_scores_saved_at', 'saved_at'),
+    )
+
     def __repr__(self):
-        return f"<CompositeScore(stock='{self.stock}', date={self.date}, score={self.composite_score})>"
\ No newline at end of file
+        return f"<CompositeScore(stock='{self.stock}', date={self.date}, score={self.composite_score})>"
+
+class DailyScore(Base):
+    __tablename__ = 'daily_scores'
+
+    stock = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    sentiment = Column(Float)
+    composite_score = Column(Float)
+    vix = Column(Float)
+    samples = Column(Integer)
+
+    __table_args__ = (
+        Index('ix_daily_scores_date', 'date'),
+    )
+
+class JobRecord(Base):
+    __tablename__ = 'jobs'
+    id = Column(String, primary_key=True)
+    key = Column(String)
+    active_key = Column(String)
+    status = Column(String)
+    stages = Column(Text)
+    result = Column(Text)
+    error = Column(Text)
+    submitted_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('uq_jobs_active_key', 'active_key', unique=True),
+        Index('ix_jobs_finished_at', 'finished_at'),
+    )
@@ -0,0 +1,152 @@
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+def event_id(moment):
+    """
+    Event id of a naive UTC datetime, in microseconds, so ids assigned by
+    different processes from the time of a database write are comparable
+    :param moment: datetime
+    :return: int
+    """
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+class Event:
+    def __init__(self, id, name, data):
+        """
+        :param id: Increasing event id, sent back by clients as Last-Event-ID, see event_id
+        :param name: SSE event name
+        :param data: JSON-serialisable payload
+        """
+        self.id = id
+        self.name = name
+        self.data = data
+
+    def encode(self):
+        """Render the event in the text/event-stream format"""
+        return f"id: {self.id}\nevent: {self.name}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+class Subscription:
+    def __init__(self, broker, maxsize):
+        self.broker = broker
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout=None):
+        """
+        Next event, None if nothing was published within timeout seconds
+        :return: Event or None
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, event):
+        """Queue an event, a slow client loses its oldest events rather than blocking publishers"""
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Broker:
+    def __init__(self, maxsize=100):
+        """
+        In-process fan-out of events to every subscriber
+        :param maxsize: Events buffered per subscriber
+        """
+        self.maxsize = maxsize
+        self.latest = None
+        self._last_id = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._fetch = None
+        self._interval = None
+        self._wake = threading.Event()
+
+    def subscribe(self):
+        """
+        Start receiving events, close the subscription when done
+        :return: Subscription
+        """
+        subscription = Subscription(self, self.maxsize)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, name, data, id=None):
+        """
+        Send an event to every subscriber, it is also kept as latest for new ones
+        :param id: Event id, defaults to the current time and always above the previous one
+        :return: Event
+        """
+        with self._lock:
+            if id is None:
+                id = max(self._last_id + 1, event_id(datetime.utcnow()))
+            self._last_id = max(self._last_id, id)
+            event = Event(id, name, data)
+            self.latest = event
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+        return event
+
+    def poll(self, fetch, interval):
+        """
+        Publish events found by fetch, e.g. written to the database by another process,
+        from one background thread for the whole process. The first call fetches once
+        before returning so new subscribers see the latest event.
+        :param fetch: Callable taking the last event id, returning a newer Event or None
+        :param interval: Seconds between fetches while anyone is subscribed
+        """
+        with self._lock:
+            started = self._fetch is not None
+            changed = interval != self._interval
+            self._fetch, self._interval = fetch, interval
+        if started:
+            if changed:
+                self._wake.set()
+            return
+
+        self._publish_fetched()
+        threading.Thread(target=self._poll_forever, name='broker-poll', daemon=True).start()
+
+    def _poll_forever(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if self._subscribers:
+                self._publish_fetched()
+
+    def _publish_fetched(self):
+        try:
+            event = self._fetch(self._last_id)
+        except Exception as e:
+            print(f"Error polling for events: {e}")
+            return
+        if event is not None and event.id > self._last_id:
+            self.publish(event.name, event.data, id=event.id)
+
+'''Composite score updates, published by save_composite_score after it commits and
+polled from the database for saves by other processes'''
+score_events = Broker()
@@ -0,0 +1,103 @@
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from .db_models import FeedState
+from .upstream import get_client
+
+class FeedResult:
+    def __init__(self, stock, entries, etag=None, modified=None, not_modified=False, error=None):
+        """
+        :param stock: Stock symbol the feed belongs to
+        :param entries: Parsed feed entries, empty when not modified or failed
+        :param etag: ETag header to send on the next request
+        :param modified: Last-Modified header to send on the next request
+        :param not_modified: True if the server answered 304
+        :param error: Exception raised while fetching, if any
+        """
+        self.stock = stock
+        self.entries = entries
+        self.etag = etag
+        self.modified = modified
+        self.not_modified = not_modified
+        self.error = error
+
+def fetch_feed(url, stock, etag=None, modified=None):
+    """
+    Conditionally fetch and parse a single feed
+    :param url: Feed URL
+    :param stock: Stock symbol
+    :param etag: ETag from the previous fetch
+    :param modified: Last-Modified from the previous fetch
+    :return: FeedResult
+    """
+    import feedparser
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+
+    try:
+        response = get_client('yahoo').get(url, headers=headers)
+        if response.status_code == 304:
+            return FeedResult(stock, [], etag, modified, not_modified=True)
+        response.raise_for_status()
+        feed = feedparser.parse(response.content, response_headers=dict(response.headers))
+    except Exception as e:
+        return FeedResult(stock, [], etag, modified, error=e)
+
+    return FeedResult(
+        stock,
+        feed.entries,
+        etag=response.headers.get('ETag', etag),
+        modified=response.headers.get('Last-Modified', modified)
+    )
+
+def fetch_feeds(url_template, states, max_workers=8):
+    """
+    Fetch the feeds of many stocks concurrently
+    :param url_template: URL with a %s placeholder for the stock symbol
+    :param states: Dictionary of stock -> (etag, modified)
+    :param max_workers: Maximum number of feeds fetched at the same time
+    :return: list of FeedResult, in the order of states
+    """
+    if not states:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(states)))) as pool:
+        futures = [
+            pool.submit(fetch_feed, url_template % stock, stock, etag, modified)
+            for stock, (etag, modified) in states.items()
+        ]
+        return [f.result() for f in futures]
+
+def load_states(session, stocks):
+    """
+    Stored validators for a list of stocks
+    :param session: Database session
+    :param stocks: list of stock symbols
+    :return: Dictionary of stock -> (etag, modified)
+    """
+    states = {stock: (None, None) for stock in stocks}
+    if not states:
+        return states
+    for state in session.query(FeedState).filter(FeedState.stock.in_(list(states))):
+        states[state.stock] = (state.etag, state.modified)
+    return states
+
+def save_states(session, results):
+    """
+    Persist the validators of fetched feeds
+    :param session: Database session
+    :param results: list of FeedResult
+    """
+    now = dt.datetime.utcnow()
+    for result in results:
+        if result.error is not None:
+            continue
+        session.merge(FeedState(
+            stock=result.stock,
+            etag=result.etag,
+            modified=result.modified,
+            checked_at=now
+        ))
@@ -0,0 +1,75 @@
+import datetime as dt
+from .db_models import FredObservation, SyncState
+from .database import insert_ignore
+from .metrics import CACHE_REQUESTS
+from .upstream import get_client
+
+FRED_URL = 'https://api.stlouisfed.org/fred/series/observations'
+
+'''Seconds before a cached series is checked for new observations'''
+DEFAULT_TTL = 3600
+
+def refresh_series(session, series_id, fred_key, start, ttl=DEFAULT_TTL, params=None):
+    """
+    Fetch observations newer than the last cached date, at most once per ttl
+    :param session: Database session
+    :param series_id: FRED series, e.g. VIXCLS
+    :param fred_key: FRED API key
+    :param start: dt.date to start from when nothing is cached
+    :param ttl: Seconds a fetch stays fresh
+    :param params: Extra request parameters, e.g. frequency
+    :return: True if the API was called
+    """
+    now = dt.datetime.utcnow()
+    state = session.get(SyncState, f'fred:{series_id}') or SyncState(name=f'fred:{series_id}')
+    if state.watermark is not None and (now - state.watermark).total_seconds() < ttl:
+        CACHE_REQUESTS.inc(cache='fred', result='hit')
+        return False
+    CACHE_REQUESTS.inc(cache='fred', result='miss')
+
+    last = session.query(FredObservation.date)\
+        .filter(FredObservation.series_id == series_id)\
+        .order_by(FredObservation.date.desc())\
+        .first()
+    date_from = last[0] + dt.timedelta(days=1) if last else start
+    date_to = dt.date.today()
+
+    if date_from <= date_to:
+        request_params = {
+            'series_id': series_id,
+            'api_key': fred_key,
+            'file_type': 'json',
+            'observation_start': date_from.strftime('%Y-%m-%d'),
+            'observation_end': date_to.strftime('%Y-%m-%d'),
+            **(params or {})
+        }
+        response = get_client('fred').get(FRED_URL, params=request_params)
+        response.raise_for_status()
+
+        '''Missing values come back as '.' and are stored as NULL'''
+        rows = [{
+            'series_id': series_id,
+            'date': dt.datetime.strptime(obs['date'], '%Y-%m-%d').date(),
+            'value': float(obs['value']) if obs['value'] not in {'.', ''} else None,
+            'fetched_at': now
+        } for obs in response.json().get('observations', [])]
+        insert_ignore(session, FredObservation, rows)
+
+    state.watermark = now
+    session.merge(state)
+    return True
+
+def get_observations(session, series_id, start, end):
+    """
+    Cached, valid observations of a series between two dates
+    :return: list of (dt.date, float), oldest first
+    """
+    query = session.query(FredObservation.date, FredObservation.value)\
+        .filter(
+            FredObservation.series_id == series_id,
+            FredObservation.date >= start,
+            FredObservation.date <= end,
+            FredObservation.value.isnot(None)
+        )\
+        .order_by(FredObservation.date)
+    return [(row.date, row.value) for row in query]
@@ -0,0 +1,170 @@
+"""
+Ingest a large ticker universe with one worker process per shard
+
+    python -m backend.ingest --universe sp500.txt --shards 8
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from .stock_news import StockNews
+from .database import init_db, dispose_engines
+from .sentiment import get_analyzer, reset_sentiment_engines
+from .upstream import configure, limits, reset_clients, split_limits
+from .cache import response_cache
+from .metrics import timed_stage
+
+DEFAULT_STOCKS = ['AAPL', 'MSFT', 'NVDA', 'META', 'TSLA', 'AMZN', 'GOOG']
+
+'''Upper bound on shard processes, whatever a caller asks for'''
+MAX_SHARDS = int(os.getenv('INGEST_MAX_SHARDS', os.cpu_count() or 1))
+
+'''Workers start as fresh interpreters - a fork from a threaded web worker would inherit
+locks other threads held at that moment, e.g. the sentiment LRU or the metrics'''
+START_METHOD = os.getenv('INGEST_START_METHOD', 'spawn')
+
+def load_universe(path):
+    """
+    Read ticker symbols from a text file, one per line, or a CSV with a Symbol column
+    :param path: File name
+    :return: list of upper-case symbols, in file order without duplicates
+    """
+    with open(path, newline='') as f:
+        lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    header = lines[0].split(',') if lines else []
+    column = next((i for i, name in enumerate(header) if name.strip().lower() in ('symbol', 'ticker')), None)
+    if column is not None:
+        symbols = [row[column] for row in csv.reader(lines[1:]) if len(row) > column]
+    else:
+        symbols = [line.split(',')[0] for line in lines]
+    return list(dict.fromkeys(s.strip().upper() for s in symbols if s.strip()))
+
+def shard_stocks(stocks, shards):
+    """
+    Split symbols into shards by a stable hash, a symbol always lands in the same shard
+    :param stocks: list of symbols
+    :param shards: Number of shards
+    :return: list of non-empty lists of symbols
+    """
+    buckets = [[] for _ in range(max(1, shards))]
+    for stock in dict.fromkeys(stocks):
+        buckets[zlib.crc32(stock.encode()) % len(buckets)].append(stock)
+    return [bucket for bucket in buckets if bucket]
+
+def _init_worker(limits, shares):
+    """
+    Own connections and analyzer per worker process, and its part of the upstream limits
+    :param limits: The parent's upstream limits, see upstream.limits
+    :param shares: Number of worker processes sharing them
+    """
+    dispose_engines()
+    reset_clients()
+    for service, options in split_limits(limits, shares).items():
+        configure(service, **options)
+    reset_sentiment_engines()
+    get_analyzer()
+
+def _read_shard(stocks, db_uri, yahoo_url, fetch_workers):
+    sn = StockNews(stocks=stocks, db_uri=db_uri, fetch_workers=fetch_workers)
+    sn.YAHOO_URL = yahoo_url
+    return sn.read_rss()
+
+def _price_shard(stocks, db_uri, wt_key, trading_url, closing_hour, closing_minute):
+    sn = StockNews(stocks=stocks, db_uri=db_uri, wt_key=wt_key,
+                   closing_hour=closing_hour, closing_minute=closing_minute)
+    sn.TRADING_URL = trading_url
+    return sn.check_prices()
+
+class ShardedIngest:
+    YAHOO_URL = StockNews.YAHOO_URL
+    TRADING_URL = StockNews.TRADING_URL
+
+    def __init__(self, stocks, wt_key=None, db_uri='sqlite:///stock_news.db',
+                 shards=None, closing_hour=20, closing_minute=0, fetch_workers=8):
+        """
+        Drop-in for StockNews.read_rss and summarize over many processes.
+        Shards never share a symbol, news seen by several shards are merged by insert_ignore.
+        :param stocks: A list of stock symbols
+        :param shards: Worker processes, defaults to the number of CPUs, at most MAX_SHARDS
+        :param fetch_workers: feeds fetched at the same time in each worker
+        """
+        self.stocks = stocks
+        self.wt_key = wt_key
+        self.db_uri = db_uri
+        self.closing_hour = closing_hour
+        self.closing_minute = closing_minute
+        self.fetch_workers = fetch_workers
+        self.shards = shard_stocks(stocks, min(shards or os.cpu_count() or 1, MAX_SHARDS))
+
+        '''Create the schema before any worker connects'''
+        init_db(db_uri)
+
+    def _map(self, fn, *args):
+        """Run fn(shard, *args) in one process per shard, the shards split the upstream limits"""
+        if not self.shards:
+            return []
+        with ProcessPoolExecutor(max_workers=len(self.shards), initializer=_init_worker,
+                                 initargs=(limits(), len(self.shards)),
+                                 mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+            futures = [pool.submit(fn, shard, *args) for shard in self.shards]
+            return [future.result() for future in futures]
+
+    @timed_stage('read_rss')
+    def read_rss(self):
+        """
+        Fetch, score and store the news of every shard
+        :return: True if successful
+        """
+        return all(self._map(_read_shard, self.db_uri, self.YAHOO_URL, self.fetch_workers))
+
+    @timed_stage('summarize')
+    def summarize(self):
+        """
+        Summarize news once for the whole universe, then fetch prices per shard
+        :return: <int> number of requests made
+        """
+        StockNews(
+            stocks=[],
+            db_uri=self.db_uri,
+            closing_hour=self.closing_hour,
+            closing_minute=self.closing_minute
+        ).summarize_news()
+        requests_made = sum(self._map(
+            _price_shard, self.db_uri, self.wt_key, self.TRADING_URL, self.closing_hour, self.closing_minute
+        ))
+        response_cache.invalidate()
+        return requests_made
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--universe', help='file with one symbol per line or a CSV with a Symbol column')
+    parser.add_argument('--stocks', help='comma separated symbols')
+    parser.add_argument('--shards', type=int, default=os.cpu_count())
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--db-uri', default=os.getenv('DATABASE_URL', 'sqlite:///stock_news.db'))
+    args = parser.parse_args()
+
+    if args.universe:
+        stocks = load_universe(args.universe)
+    elif args.stocks:
+        stocks = args.stocks.upper().split(',')
+    else:
+        stocks = DEFAULT_STOCKS
+
+    ingest = ShardedIngest(
+        stocks=stocks,
+        wt_key=os.getenv('WT_KEY'),
+        db_uri=args.db_uri,
+        shards=args.shards,
+        fetch_workers=args.fetch_workers
+    )
+    print(f"Ingesting {len(stocks)} stocks in {len(ingest.shards)} shards")
+    ingest.read_rss()
+    requests_made = ingest.summarize()
+    print(f"\nMade {requests_made} API requests to World Trading Data")
+
+if __name__ == '__main__':
+    main()
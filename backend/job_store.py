@@ -0,0 +1,116 @@
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from .db_models import JobRecord
+from .database import init_db, session_scope
+
+'''A running job whose worker has not touched it for this long is considered dead'''
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 120))
+
+class StoredJob:
+    def __init__(self, record):
+        """
+        Snapshot of a job owned by another process, read from the jobs table
+        :param record: JobRecord
+        """
+        def iso(value):
+            return value.isoformat() if value else None
+
+        self.id = record.id
+        self.status = record.status
+        self._dict = {
+            'id': record.id,
+            'status': record.status,
+            'submitted_at': iso(record.submitted_at),
+            'started_at': iso(record.started_at),
+            'finished_at': iso(record.finished_at),
+            'stages': json.loads(record.stages or '[]'),
+            'result': json.loads(record.result) if record.result else None,
+            'error': record.error
+        }
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        return self._dict
+
+class JobStore:
+    def __init__(self, db_uri, stale_seconds=JOB_STALE_SECONDS):
+        """
+        Job status shared by every process using the database, so any gunicorn
+        worker can answer a status poll or merge a duplicate submission
+        :param db_uri: Database connection string
+        :param stale_seconds: Active jobs not updated for this long are taken over
+        """
+        self.engine = init_db(db_uri)
+        self.stale_seconds = stale_seconds
+
+    @staticmethod
+    def key_string(key):
+        return ','.join(map(str, key)) if isinstance(key, (tuple, list)) else str(key)
+
+    def claim(self, job):
+        """
+        Record a new job as the active one for its key. The unique index on active_key
+        makes this atomic across processes.
+        :param job: Job
+        :return: None if claimed, otherwise the StoredJob already active for the key
+        """
+        key = self.key_string(job.key)
+        for _ in range(2):
+            try:
+                with session_scope(self.engine) as session:
+                    active = session.query(JobRecord).filter(JobRecord.active_key == key).first()
+                    if active is not None:
+                        if active.updated_at >= datetime.utcnow() - timedelta(seconds=self.stale_seconds):
+                            return StoredJob(active)
+                        active.active_key = None
+                        active.status = 'failed'
+                        active.error = 'Abandoned by its worker'
+                        active.finished_at = datetime.utcnow()
+                        session.flush()
+                    session.add(JobRecord(**self._values(job), id=job.id, key=key,
+                                          submitted_at=job.submitted_at))
+                return None
+            except IntegrityError:
+                '''Another process claimed the key first, read its job on the next pass'''
+                continue
+        raise RuntimeError(f"Could not claim job key {key}")
+
+    def save(self, job):
+        """Write a job's current status, releasing its key when it finishes"""
+        with session_scope(self.engine) as session:
+            session.execute(update(JobRecord).where(JobRecord.id == job.id).values(**self._values(job)))
+
+    def touch(self, job_ids):
+        """Mark running jobs as alive"""
+        if not job_ids:
+            return
+        with session_scope(self.engine) as session:
+            session.execute(
+                update(JobRecord).where(JobRecord.id.in_(job_ids)).values(updated_at=datetime.utcnow())
+            )
+
+    def get(self, job_id):
+        """
+        :return: StoredJob or None
+        """
+        with session_scope(self.engine) as session:
+            record = session.get(JobRecord, job_id)
+            return StoredJob(record) if record is not None else None
+
+    def _values(self, job):
+        return {
+            'active_key': self.key_string(job.key) if job.active else None,
+            'status': job.status,
+            'stages': json.dumps(job.to_dict()['stages']),
+            'result': json.dumps(job.result, default=str) if job.result is not None else None,
+            'error': job.error,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'updated_at': datetime.utcnow()
+        }
@@ -0,0 +1,178 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+class Job:
+    def __init__(self, key, stages, on_change=None):
+        """
+        :param key: Identity of the work, equal keys are merged while a job is active
+        :param stages: list of (name, callable), each callable gets the previous stage's result
+        :param on_change: Called with the job after every status change
+        """
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.stages = [{'name': name, 'status': 'pending', 'started_at': None,
+                        'finished_at': None, 'seconds': None} for name, _ in stages]
+        self._callables = [fn for _, fn in stages]
+        self.status = 'queued'
+        self.submitted_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._on_change = on_change
+        self._done = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def run(self):
+        """Run every stage in order, stopping at the first failure"""
+        self.status = 'running'
+        self.started_at = datetime.utcnow()
+        result = None
+        try:
+            for stage, fn in zip(self.stages, self._callables):
+                stage['status'] = 'running'
+                stage['started_at'] = datetime.utcnow()
+                self._changed()
+                t0 = time.perf_counter()
+                try:
+                    result = fn(result)
+                except Exception:
+                    stage['status'] = 'failed'
+                    raise
+                finally:
+                    stage['seconds'] = round(time.perf_counter() - t0, 3)
+                    stage['finished_at'] = datetime.utcnow()
+                stage['status'] = 'succeeded'
+            self.result = result
+            self.status = 'succeeded'
+        except Exception as e:
+            print(f"Job {self.id} failed: {traceback.format_exc()}")
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self.finished_at = datetime.utcnow()
+            self._changed()
+            self._done.set()
+
+    def _changed(self):
+        """Report a status change, a failing listener never fails the job"""
+        if self._on_change is None:
+            return
+        try:
+            self._on_change(self)
+        except Exception as e:
+            print(f"Error saving job {self.id}: {str(e)}")
+
+    def wait(self, timeout=None):
+        """Block until the job finishes, returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        def iso(value):
+            return value.isoformat() if value else None
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'submitted_at': iso(self.submitted_at),
+            'started_at': iso(self.started_at),
+            'finished_at': iso(self.finished_at),
+            'stages': [{
+                **stage,
+                'started_at': iso(stage['started_at']),
+                'finished_at': iso(stage['finished_at'])
+            } for stage in self.stages],
+            'result': self.result,
+            'error': self.error
+        }
+
+'''Seconds between liveness updates of running jobs in the store'''
+JOB_HEARTBEAT_SECONDS = 30
+
+class JobRunner:
+    def __init__(self, max_workers=2, keep=200, store=None):
+        """
+        :param max_workers: Jobs run at the same time
+        :param keep: Finished jobs remembered for status polling
+        :param store: JobStore shared with other processes, None keeps jobs in this process only
+        """
+        self.keep = keep
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def submit(self, key, stages):
+        """
+        Queue a job, or return the active job with the same key
+        :param key: Hashable identity of the work
+        :param stages: list of (name, callable)
+        :return: (Job, created)
+        """
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None and job.active:
+                return job, False
+
+            job = Job(key, stages, on_change=self.store.save if self.store else None)
+            if self.store is not None:
+                '''Another worker may already be running the same work'''
+                other = self.store.claim(job)
+                if other is not None:
+                    return other, False
+                self._start_heartbeat()
+
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._prune()
+
+        self._pool.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        """Return a job of this process, or the stored snapshot of another's, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.get(job_id)
+        return job
+
+    def _start_heartbeat(self):
+        """Keep this process' running jobs fresh in the store so others do not take them over"""
+        if self._heartbeat is not None:
+            return
+
+        def beat():
+            while True:
+                time.sleep(JOB_HEARTBEAT_SECONDS)
+                with self._lock:
+                    running = [job.id for job in self._active.values() if job.active]
+                try:
+                    self.store.touch(running)
+                except Exception as e:
+                    print(f"Error updating job heartbeat: {str(e)}")
+
+        self._heartbeat = threading.Thread(target=beat, name='job-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _run(self, job):
+        job.run()
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the keep limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[job_id]
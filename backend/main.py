@@ -1,9 +1,10 @@
 from .stock_news import StockNews
+from .ingest import DEFAULT_STOCKS
 from .composite import get_composite_score, get_historical
 
 def main():
     sn = StockNews(
-        stocks=['AAPL','MSFT', 'NVDA', 'META', 'TSLA', 'AMZN', 'GOOG'],
+        stocks=DEFAULT_STOCKS,
         wt_key='c7715110619adf30614fdb3f2973327d',
     )
     
@@ -0,0 +1,140 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+'''Latency buckets in seconds'''
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    """Render label pairs as {name="value",...}"""
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            buckets, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[i] += 1
+            self._values[key] = (buckets, total + value, count + 1)
+
+    def count(self, **labels):
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (buckets, total, count) in sorted(self._values.items()):
+                for bound, bucket in zip(self.buckets, buckets):
+                    lines.append(f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {bucket}')
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation):
+        return self._get(Counter, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+'''Process-wide registry, each gunicorn worker exposes its own'''
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'mmd_stage_seconds', 'Duration of pipeline stages')
+UPSTREAM_REQUESTS = registry.counter(
+    'mmd_upstream_requests_total', 'Calls to upstream APIs by service and outcome')
+UPSTREAM_SECONDS = registry.histogram(
+    'mmd_upstream_request_seconds', 'Latency of upstream API calls')
+CACHE_REQUESTS = registry.counter(
+    'mmd_cache_requests_total', 'Cache lookups by cache and result')
+ROWS_WRITTEN = registry.counter(
+    'mmd_rows_written_total', 'Rows written by table')
+DB_WRITE_SECONDS = registry.histogram(
+    'mmd_db_write_seconds', 'Duration of bulk database writes')
+SENTIMENT_TEXTS = registry.counter(
+    'mmd_sentiment_texts_total', 'Texts scored by VADER')
+HTTP_REQUESTS = registry.counter(
+    'mmd_http_requests_total', 'Flask requests by route, method and status')
+HTTP_SECONDS = registry.histogram(
+    'mmd_http_request_seconds', 'Flask request latency by route')
+
+def timed_stage(stage):
+    """Decorator recording a function's duration under mmd_stage_seconds"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,138 @@
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from .db_models import Base
+from .rollups import refresh_daily_scores
+
+'''Postgres advisory lock id held while migrating'''
+MIGRATION_LOCK_KEY = 7316280411
+
+def add_missing_columns(conn, inspector):
+    """
+    Add nullable columns introduced after a table was first created,
+    create_all only creates missing tables
+    """
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        present = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+def dedupe_composite_scores(conn):
+    """Keep the latest row per (stock, date) so the unique index can be built"""
+    conn.execute(text("""
+        DELETE FROM composite_scores
+        WHERE id NOT IN (
+            SELECT keep_id FROM (
+                SELECT MAX(id) AS keep_id FROM composite_scores GROUP BY stock, date
+            ) AS latest
+        )
+    """))
+
+def create_missing_indexes(conn, inspector):
+    """Create every index declared on the models that the database lacks"""
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        present = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in present:
+                continue
+            if index.name == 'uq_composite_scores_stock_date':
+                dedupe_composite_scores(conn)
+            index.create(conn)
+
+'''Indexes earlier versions created that nothing queries any more'''
+RETIRED_INDEXES = ['ix_news_ingested_at']
+
+def drop_retired_indexes(conn, inspector):
+    """Drop indexes the models no longer declare, they only slow down inserts"""
+    present = {ix['name'] for table in inspector.get_table_names() for ix in inspector.get_indexes(table)}
+    for name in RETIRED_INDEXES:
+        if name in present:
+            conn.execute(text(f'DROP INDEX {name}'))
+
+def adopt_unbatched_news(conn):
+    """
+    Put news stored before ingest batches existed into one batch so they are
+    summarized once more, and folded into rolling sentiment unless it already holds them
+    """
+    if conn.execute(text('SELECT 1 FROM news WHERE batch_id IS NULL LIMIT 1')).first() is None:
+        return
+    rolled = conn.execute(text('SELECT 1 FROM rolling_sentiment LIMIT 1')).first() is not None
+    now = datetime.utcnow()
+    conn.execute(
+        text('INSERT INTO ingest_batches (created_at, rolled_at) VALUES (:now, :rolled_at)'),
+        {'now': now, 'rolled_at': now if rolled else None}
+    )
+    batch_id = conn.execute(text('SELECT MAX(id) FROM ingest_batches')).scalar()
+    conn.execute(text('UPDATE news SET batch_id = :batch_id WHERE batch_id IS NULL'), {'batch_id': batch_id})
+
+@contextmanager
+def migration_lock(engine):
+    """
+    Hold an exclusive lock across processes while the schema is changed, an advisory
+    lock on Postgres and a lock file next to a SQLite database
+    :param engine: Engine
+    """
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        return
+
+    database = engine.url.database
+    if engine.dialect.name != 'sqlite' or database in (None, '', ':memory:'):
+        yield
+        return
+
+    try:
+        import fcntl
+    except ImportError:
+        '''No flock on Windows, where gunicorn does not run either'''
+        yield
+        return
+    with open(f"{os.path.abspath(database)}.migrate.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def upgrade(engine):
+    """
+    Bring an existing SQLite or Postgres database up to the current models. Processes
+    starting together take turns, the later ones find nothing left to do.
+    :param engine: Engine
+    """
+    with migration_lock(engine):
+        _upgrade(engine)
+
+def _upgrade(engine):
+    with engine.begin() as conn:
+        new_rollup = not inspect(conn).has_table('daily_scores')
+        new_batches = not inspect(conn).has_table('ingest_batches')
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        add_missing_columns(conn, inspector)
+        create_missing_indexes(conn, inspector)
+        drop_retired_indexes(conn, inspector)
+        if new_rollup:
+            refresh_daily_scores(conn)
+        if new_batches:
+            adopt_unbatched_news(conn)
+
+if __name__ == '__main__':
+    '''python -m backend.migrations sqlite:///stock_news.db'''
+    upgrade(create_engine(sys.argv[1]))
+    print(f"Upgraded {sys.argv[1]}")
@@ -0,0 +1,90 @@
+import datetime as dt
+import requests
+from .db_models import PriceBar
+from .database import insert_ignore, session_scope
+from .metrics import CACHE_REQUESTS
+from .upstream import get_client
+
+class PriceClient:
+    def __init__(self, url, api_token):
+        """
+        :param url: World Trading Data history endpoint
+        :param api_token: World Trading Data key
+        """
+        self.url = url
+        self.api_token = api_token
+        self.http = get_client('worldtradingdata')
+        self.requests_made = 0
+
+    def get_bars(self, engine, symbol, days):
+        """
+        Daily OHLCV bars for a symbol, read from the local cache and fetched
+        with one range request for the days that are missing. The request runs
+        outside any transaction, so other writers are not blocked meanwhile.
+        :param engine: Database engine
+        :param symbol: Stock symbol
+        :param days: iterable of dt.date
+        :return: Dictionary of dt.date -> row with open, close, high, low and volume
+        """
+        days = sorted(set(days))
+        if not days:
+            return {}
+
+        with session_scope(engine) as session:
+            bars = self._cached(session, symbol, days[0], days[-1])
+        missing = [day for day in days if day not in bars]
+        CACHE_REQUESTS.inc(len(days) - len(missing), cache='price', result='hit')
+        CACHE_REQUESTS.inc(len(missing), cache='price', result='miss')
+        if missing:
+            rows = self._fetch(symbol, missing[0], missing[-1])
+            with session_scope(engine) as session:
+                insert_ignore(session, PriceBar, rows)
+                bars = self._cached(session, symbol, days[0], days[-1])
+
+        return {day: bars[day] for day in days if day in bars}
+
+    @staticmethod
+    def _cached(session, symbol, date_from, date_to):
+        """Stored bars of a symbol between two dates, inclusive"""
+        query = session.query(
+            PriceBar.day, PriceBar.open, PriceBar.close, PriceBar.high, PriceBar.low, PriceBar.volume
+        ).filter(
+            PriceBar.symbol == symbol,
+            PriceBar.day >= date_from,
+            PriceBar.day <= date_to
+        )
+        return {bar.day: bar for bar in query}
+
+    def _fetch(self, symbol, date_from, date_to):
+        """
+        Request a date range of history for one symbol
+        :return: list of PriceBar dictionaries
+        """
+        params = {
+            'symbol': symbol,
+            'date_from': date_from.strftime('%Y-%m-%d'),
+            'date_to': date_to.strftime('%Y-%m-%d'),
+            'api_token': self.api_token
+        }
+
+        self.requests_made += 1
+        try:
+            r = self.http.get(self.url, params=params)
+        except requests.RequestException as e:
+            print(f"Error fetching prices for {symbol}: {e}")
+            return []
+        if r.status_code != 200:
+            return []
+
+        history = r.json().get('history') or {}
+        now = dt.datetime.utcnow()
+        return [{
+            'symbol': symbol,
+            'day': dt.datetime.strptime(day, '%Y-%m-%d').date(),
+            'open': float(bar['open']),
+            'close': float(bar['close']),
+            'high': float(bar['high']),
+            'low': float(bar['low']),
+            'volume': float(bar['volume']),
+            'fetched_at': now
+        } for day, bar in history.items()]
@@ -0,0 +1,140 @@
+"""
+Chunked retention for the pipeline tables, optionally archiving to Parquet first
+
+    python -m backend.retention --db-uri sqlite:///stock_news.db --archive-dir archive
+"""
+import argparse
+import datetime as dt
+import os
+import uuid
+import pandas as pd
+from sqlalchemy import Date, delete, select, tuple_
+from .db_models import News, Summary, CompositeScore, DailyScore, PriceBar, FredObservation, JobRecord
+from .database import init_db, session_scope
+from .cache import response_cache
+from .metrics import ROWS_WRITTEN, timed_stage
+
+'''Table -> (model, date column)'''
+TABLES = {
+    'news': (News, News.published),
+    'summary': (Summary, Summary.check_day),
+    'composite_scores': (CompositeScore, CompositeScore.date),
+    'daily_scores': (DailyScore, DailyScore.date),
+    'price_bars': (PriceBar, PriceBar.day),
+    'fred_observations': (FredObservation, FredObservation.date),
+    'jobs': (JobRecord, JobRecord.finished_at),
+}
+
+'''Days kept per table, None keeps everything - summaries and prices feed the backtests'''
+DEFAULT_HORIZONS = {
+    'news': 180,
+    'summary': None,
+    'composite_scores': 365,
+    'daily_scores': None,
+    'price_bars': None,
+    'fred_observations': None,
+    'jobs': 30,
+}
+
+def horizons_from_env(defaults=DEFAULT_HORIZONS):
+    """
+    Override horizons with RETENTION_<TABLE>_DAYS, an empty value keeps everything
+    :return: Dictionary of table -> days or None
+    """
+    horizons = dict(defaults)
+    for table in TABLES:
+        value = os.getenv(f'RETENTION_{table.upper()}_DAYS')
+        if value is not None:
+            horizons[table] = int(value) if value.strip() else None
+    return horizons
+
+def _archive(df, archive_dir, table, date_name):
+    """Write rows to <archive_dir>/<table>/archive_date=YYYY-MM-DD/<uuid>.parquet"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError("Archiving requires pyarrow: pip install pyarrow") from e
+
+    days = pd.to_datetime(df[date_name]).dt.date
+    for day, part in df.groupby(days):
+        path = os.path.join(archive_dir, table, f"archive_date={day.isoformat()}")
+        os.makedirs(path, exist_ok=True)
+        part.to_parquet(os.path.join(path, f"{uuid.uuid4().hex}.parquet"), index=False)
+
+def purge_table(engine, table, days, chunk_size=5000, archive_dir=None, today=None):
+    """
+    Delete rows older than a horizon in bounded chunks, one transaction per chunk
+    :param engine: Engine
+    :param table: Name from TABLES
+    :param days: Rows dated before today minus this many days are removed
+    :param chunk_size: Rows per transaction, keeps write locks short
+    :param archive_dir: Archive each chunk as Parquet before deleting it
+    :param today: dt.date to count from, defaults to today
+    :return: <int> rows deleted
+    """
+    model, date_col = TABLES[table]
+    cutoff = (today or dt.date.today()) - dt.timedelta(days=days)
+    if not isinstance(date_col.type, Date):
+        cutoff = dt.datetime.combine(cutoff, dt.time())
+
+    pk = list(model.__table__.primary_key.columns)
+    key = pk[0] if len(pk) == 1 else tuple_(*pk)
+    deleted = 0
+
+    while True:
+        with session_scope(engine) as session:
+            if archive_dir:
+                chunk = pd.read_sql(
+                    select(model.__table__).where(date_col < cutoff).limit(chunk_size),
+                    session.connection()
+                )
+                if chunk.empty:
+                    break
+                _archive(chunk, archive_dir, table, date_col.key)
+                keys = list(chunk[[c.key for c in pk]].astype(object).itertuples(index=False, name=None))
+            else:
+                keys = session.execute(select(*pk).where(date_col < cutoff).limit(chunk_size)).all()
+                if not keys:
+                    break
+                keys = [tuple(k) for k in keys]
+
+            values = [k[0] for k in keys] if len(pk) == 1 else keys
+            session.execute(delete(model.__table__).where(key.in_(values)))
+
+        deleted += len(keys)
+        ROWS_WRITTEN.inc(len(keys), table=f'{table}_deleted')
+        if len(keys) < chunk_size:
+            break
+    return deleted
+
+@timed_stage('retention')
+def apply_retention(db_uri, horizons=None, chunk_size=5000, archive_dir=None, today=None):
+    """
+    Apply the retention horizon of every table
+    :param db_uri: Database connection string
+    :param horizons: Dictionary of table -> days or None, defaults to horizons_from_env()
+    :return: Dictionary of table -> rows deleted
+    """
+    horizons = horizons if horizons is not None else horizons_from_env()
+    engine = init_db(db_uri)
+    deleted = {}
+    for table, days in horizons.items():
+        if days is None:
+            continue
+        deleted[table] = purge_table(engine, table, days, chunk_size, archive_dir, today)
+        print(f"Removed {deleted[table]} rows from {table} older than {days} days")
+
+    if any(deleted.values()):
+        response_cache.invalidate()
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-uri', default=os.getenv('DATABASE_URL', 'sqlite:///stock_news.db'))
+    parser.add_argument('--archive-dir', help='archive deleted rows as date-partitioned Parquet here')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+    apply_retention(args.db_uri, chunk_size=args.chunk_size, archive_dir=args.archive_dir)
+
+if __name__ == '__main__':
+    main()
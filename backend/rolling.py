@@ -0,0 +1,97 @@
+import datetime as dt
+import os
+import pandas as pd
+from .db_models import IngestBatch, News, RollingSentiment
+from .batches import claim_batches
+from .metrics import ROWS_WRITTEN
+
+'''A headline counts half as much after this many hours'''
+HALF_LIFE_HOURS = float(os.getenv('SENTIMENT_HALF_LIFE_HOURS', 12))
+
+def decay(start, end, half_life_hours=HALF_LIFE_HOURS):
+    """
+    Factor a weight recorded at start has shrunk by at end
+    :param start: datetime
+    :param end: datetime
+    :return: float
+    """
+    return 0.5 ** ((end - start).total_seconds() / (half_life_hours * 3600))
+
+def add_news(state, sentiment, published, half_life_hours=HALF_LIFE_HOURS):
+    """
+    Fold one headline into a stock's decayed sums in O(1). The sums are kept as of
+    the newest headline, older headlines arriving late are added already decayed.
+    :param state: RollingSentiment
+    :param sentiment: Compound score of the headline
+    :param published: datetime of the headline
+    """
+    if state.as_of is None:
+        state.total, state.weight, state.news, state.as_of = 0.0, 0.0, 0, published
+
+    if published >= state.as_of:
+        factor = decay(state.as_of, published, half_life_hours)
+        state.total = state.total * factor + sentiment
+        state.weight = state.weight * factor + 1.0
+        state.as_of = published
+    else:
+        factor = decay(published, state.as_of, half_life_hours)
+        state.total += sentiment * factor
+        state.weight += factor
+    state.news += 1
+
+def update_rolling(session, half_life_hours=HALF_LIFE_HOURS, chunk_size=500):
+    """
+    Fold the news of the batches committed since the last run into the per stock sums
+    :param session: Database session
+    :return: <int> number of news added
+    """
+    batch_ids = claim_batches(session, IngestBatch.rolled_at)
+    if not batch_ids:
+        return 0
+
+    rows = []
+    for i in range(0, len(batch_ids), chunk_size):
+        rows.extend(
+            session.query(News.stock, News.published, News.sentiment_summary)
+            .filter(News.batch_id.in_(batch_ids[i:i + chunk_size]), News.sentiment_summary.isnot(None))
+        )
+
+    '''Oldest first so most headlines take the forward path'''
+    rows.sort(key=lambda row: row.published)
+
+    stocks = {row.stock for row in rows}
+    sums = {
+        s.stock: s for s in session.query(RollingSentiment).filter(RollingSentiment.stock.in_(stocks))
+    } if stocks else {}
+    for row in rows:
+        if row.stock not in sums:
+            sums[row.stock] = RollingSentiment(stock=row.stock)
+            session.add(sums[row.stock])
+        add_news(sums[row.stock], row.sentiment_summary, row.published, half_life_hours)
+
+    ROWS_WRITTEN.inc(len(stocks), table='rolling_sentiment')
+    return len(rows)
+
+def current_sentiment(session, now=None, stocks=None, half_life_hours=HALF_LIFE_HOURS):
+    """
+    Decayed sentiment of every stock, read without touching the news
+    :param session: Database session
+    :param now: datetime the weights are decayed to, defaults to utcnow
+    :param stocks: Only these stocks, None for all
+    :return: DataFrame with stock, sentiment (decayed mean), weight (decayed news count),
+             news and as_of (newest headline)
+    """
+    now = now or dt.datetime.utcnow()
+    query = session.query(RollingSentiment).filter(RollingSentiment.weight > 0)
+    if stocks is not None:
+        query = query.filter(RollingSentiment.stock.in_(stocks))
+
+    '''Total and weight decay by the same factor, so the mean is as of any time'''
+    rows = [{
+        'stock': s.stock,
+        'sentiment': s.total / s.weight,
+        'weight': s.weight * decay(s.as_of, max(now, s.as_of), half_life_hours),
+        'news': s.news,
+        'as_of': s.as_of
+    } for s in query.order_by(RollingSentiment.stock)]
+    return pd.DataFrame(rows, columns=['stock', 'sentiment', 'weight', 'news', 'as_of'])
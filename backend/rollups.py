@@ -0,0 +1,31 @@
+from sqlalchemy import delete, func, insert, select
+from .db_models import CompositeScore, DailyScore
+
+def refresh_daily_scores(conn, dates=None):
+    """
+    Rebuild the daily rollup rows of the given dates from composite_scores.
+    Since (stock, date) is unique there, samples is always 1 - the rollup is kept
+    because retention purges composite_scores after a year while daily_scores,
+    which get_historical reads, is kept for good
+    :param conn: Connection or Session inside a transaction
+    :param dates: list of dt.date, None rebuilds every date
+    """
+    aggregate = select(
+        CompositeScore.stock,
+        CompositeScore.date,
+        func.avg(CompositeScore.sentiment),
+        func.avg(CompositeScore.composite_score),
+        func.avg(CompositeScore.vix),
+        func.count()
+    ).group_by(CompositeScore.stock, CompositeScore.date)
+
+    clear = delete(DailyScore)
+    if dates is not None:
+        aggregate = aggregate.where(CompositeScore.date.in_(dates))
+        clear = clear.where(DailyScore.date.in_(dates))
+
+    conn.execute(clear)
+    conn.execute(insert(DailyScore).from_select(
+        ['stock', 'date', 'sentiment', 'composite_score', 'vix', 'samples'],
+        aggregate
+    ))
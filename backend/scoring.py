@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+'''Map each raw factor onto 0-100'''
+NORMALISERS = {
+    'sentiment': lambda s: (s + 1) / 2 * 100,
+    'vix': lambda v: np.clip((v - 10) / (80 - 10) * 100, 0, 100),
+    #'interest_rates': ...,
+    #'unemployment': ...,
+}
+
+def weight_matrix(weights):
+    """
+    Build a scenario x factor weight frame
+    :param weights: dict of factor -> weight, list of such dicts, or a DataFrame
+    :return: DataFrame with one row per scenario and one column per factor
+    """
+    if isinstance(weights, pd.DataFrame):
+        return weights
+    if isinstance(weights, dict):
+        weights = [weights]
+    return pd.DataFrame(list(weights)).fillna(0.0)
+
+def score_scenarios(sentiment_df, macro_df, weights):
+    """
+    Composite scores for every (stock, date, scenario) in one pass
+    :param sentiment_df: DataFrame with stock, date and sentiment columns
+    :param macro_df: DataFrame with a date column and one column per macro factor,
+                     the latest value on or before each sentiment date is used
+    :param weights: Scenario weights, see weight_matrix
+    :return: DataFrame with stock, date, scenario, the raw factors and composite_score
+    """
+    weights = weight_matrix(weights)
+    factors = list(weights.columns)
+    macro_cols = [c for c in macro_df.columns if c != 'date']
+
+    if sentiment_df.empty:
+        return pd.DataFrame(columns=['stock', 'date', 'scenario', 'sentiment', *macro_cols, 'composite_score'])
+
+    '''Align macro values with sentiment dates'''
+    left = sentiment_df.assign(_ts=pd.to_datetime(sentiment_df['date'])).sort_values('_ts')
+    right = macro_df.assign(_ts=pd.to_datetime(macro_df['date'])).drop(columns='date').sort_values('_ts')
+    frame = pd.merge_asof(left, right, on='_ts').drop(columns='_ts').reset_index(drop=True)
+
+    '''Normalised factor matrix (rows x factors) times weights (factors x scenarios)'''
+    normalised = np.column_stack([
+        NORMALISERS[f](frame[f].to_numpy(dtype=float)) for f in factors
+    ])
+    scores = np.clip(normalised @ weights.to_numpy(dtype=float).T, 0, 100)
+
+    n_rows, n_scenarios = scores.shape
+    result = frame.loc[np.repeat(np.arange(n_rows), n_scenarios), ['stock', 'date', 'sentiment', *macro_cols]]
+    result = result.reset_index(drop=True)
+    result.insert(2, 'scenario', np.tile(weights.index.to_numpy(), n_rows))
+    result['composite_score'] = scores.ravel()
+    return result
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from .db_models import SentimentScore
+from .database import insert_ignore
+from .metrics import CACHE_REQUESTS, SENTIMENT_TEXTS, timed_stage
+
+'''One analyzer per process - loading the VADER lexicon is the expensive part'''
+_analyzer = None
+
+def get_analyzer():
+    """
+    Return this process' analyzer, loading the lexicon on first use
+    :return: SentimentIntensityAnalyzer
+    """
+    global _analyzer
+    if _analyzer is None:
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+def _score_chunk(texts):
+    """Score a list of strings with the process-local analyzer"""
+    if not texts:
+        return []
+    sia = get_analyzer()
+    return [sia.polarity_scores(text or '')['compound'] for text in texts]
+
+def text_key(text):
+    """
+    Hash of a text with runs of whitespace collapsed, VADER splits on whitespace
+    so texts with the same key get the same score
+    :param text: str or None
+    :return: str
+    """
+    return hashlib.sha1(' '.join((text or '').split()).encode('utf-8')).hexdigest()
+
+class LRUCache:
+    def __init__(self, maxsize):
+        """
+        :param maxsize: Entries kept, the least recently used are evicted first
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        :return: Dictionary of the keys found -> value
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+'''Recently seen scores, shared by every engine in the process'''
+_memo = LRUCache(int(os.getenv('SENTIMENT_CACHE_SIZE', 50000)))
+
+def clear_memo():
+    """Forget the recently seen scores, e.g. so a benchmark repeat scores its texts again"""
+    _memo.clear()
+
+def load_scores(session, keys, chunk_size=500):
+    """
+    Stored scores of text keys, one IN query per chunk
+    :return: Dictionary of key -> compound score
+    """
+    keys = list(keys)
+    found = {}
+    for i in range(0, len(keys), chunk_size):
+        query = session.query(SentimentScore.text_hash, SentimentScore.compound)\
+            .filter(SentimentScore.text_hash.in_(keys[i:i + chunk_size]))
+        found.update((row.text_hash, row.compound) for row in query)
+    return found
+
+def save_scores(session, scores):
+    """
+    Store computed scores, keys stored meanwhile by another process are skipped
+    :param scores: Dictionary of text key -> compound score
+    """
+    insert_ignore(session, SentimentScore, [
+        {'text_hash': key, 'compound': value} for key, value in scores.items()
+    ])
+
+class SentimentEngine:
+    def __init__(self, processes=None, chunk_size=500, min_parallel=2000):
+        """
+        :param processes: Worker processes for large batches, None or 1 to score in-process
+        :param chunk_size: Number of texts sent to a worker at a time
+        :param min_parallel: Batches smaller than this are always scored in-process
+        """
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self._pool = None
+
+    def score(self, text):
+        """
+        Compound VADER score of a single string
+        :param text: str
+        :return: float
+        """
+        return self.score_batch([text])[0]
+
+    @timed_stage('sentiment')
+    def score_batch(self, texts, session=None, stored=None, fresh=None):
+        """
+        Compound VADER scores for many strings, in input order. Each distinct text is
+        scored once, repeats are served from the in-memory LRU or the stored scores.
+        :param texts: iterable of str
+        :param session: Database session, stored scores are read and extended when given
+        :param stored: Dictionary of text key -> score already read with load_scores,
+                       lets callers score outside a session
+        :param fresh: Dictionary new scores are added to instead of being written,
+                      see save_scores
+        :return: list of float
+        """
+        keys = [(text_key(text), text) for text in texts]
+        scores = _memo.get_many(key for key, _ in keys)
+        CACHE_REQUESTS.inc(len(scores), cache='sentiment', result='hit')
+
+        missing = {key: text for key, text in keys if key not in scores}
+        if missing and (session is not None or stored is not None):
+            if stored is None:
+                stored = load_scores(session, missing)
+            found = {key: stored[key] for key in missing if key in stored}
+            CACHE_REQUESTS.inc(len(found), cache='sentiment', result='stored')
+            scores.update(found)
+            missing = {key: text for key, text in missing.items() if key not in found}
+
+        if missing:
+            CACHE_REQUESTS.inc(len(missing), cache='sentiment', result='miss')
+            new = dict(zip(missing, self._score(list(missing.values()))))
+            scores.update(new)
+            if fresh is not None:
+                fresh.update(new)
+            elif session is not None:
+                save_scores(session, new)
+
+        _memo.put_many(scores)
+        return [scores[key] for key, _ in keys]
+
+    def _score(self, texts):
+        """Run VADER over texts, in worker processes for large batches"""
+        SENTIMENT_TEXTS.inc(len(texts))
+        if not self.processes or self.processes < 2 or len(texts) < self.min_parallel:
+            return _score_chunk(texts)
+
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        scores = []
+        for chunk_scores in self._get_pool().map(_score_chunk, chunks):
+            scores.extend(chunk_scores)
+        return scores
+
+    def _get_pool(self):
+        """Start the worker pool on first use, each worker loads the lexicon once"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, initializer=get_analyzer)
+        return self._pool
+
+    def close(self):
+        """Shut down the worker pool if one was started"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+'''Engines shared by every StockNews in the process, keyed by worker processes'''
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_sentiment_engine(processes=None):
+    """
+    Return the process-wide engine for a pool size, so short-lived callers
+    never start a worker pool of their own
+    :param processes: Worker processes for large batches, None or 1 to score in-process
+    :return: SentimentEngine
+    """
+    key = processes if processes and processes > 1 else None
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = SentimentEngine(processes=key)
+        return _engines[key]
+
+def reset_sentiment_engines():
+    """Forget engines inherited from a parent process, their worker pools belong to the parent"""
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    _engines.clear()
@@ -1,13 +1,18 @@
+import base64
 import datetime as dt
-import feedparser
-import nltk
-from numpy import median
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from .db_models import News, Summary
-from .database import init_db, session_scope
-import requests
+import json
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import scoped_session
+from .db_models import IngestBatch, News, Summary
+from .database import init_db, get_session_factory, session_scope, existing_keys, insert_ignore
+from .sentiment import get_sentiment_engine, load_scores, save_scores, text_key
+from .feeds import fetch_feeds, load_states, save_states
+from .prices import PriceClient
+from .batches import claim_batches, open_batch
+from .trading_calendar import get_calendar
+from .rolling import update_rolling
+from .cache import response_cache
+from .metrics import ROWS_WRITTEN, timed_stage
 import pandas as pd
 
 class StockNews:
@@ -16,7 +21,8 @@ class StockNews:
 
     def __init__(self, stocks, save_news=True, closing_hour=20,
                  closing_minute=0, wt_key=None,
-                 db_uri='sqlite:///stock_news.db'):
+                 db_uri='sqlite:///stock_news.db', sentiment_processes=None,
+                 fetch_workers=8, calendar=None):
         """
         :param stocks: A list of stock symbols
         :param news_file: Filename of saved news data
@@ -25,6 +31,9 @@ class StockNews:
         :param closing_hour: attach news for the next trading day after this
         :param closing_minute: attach news for the next trading day after this
         :param wt_key: key
+        :param sentiment_processes: worker processes used to score large batches, the pool is shared by the process
+        :param fetch_workers: number of feeds fetched at the same time
+        :param calendar: TradingCalendar assigning check days, defaults to NYSE
         """
 
         self.stocks = stocks
@@ -34,135 +43,257 @@ class StockNews:
         self.wt_key = wt_key
         self.db_uri = db_uri
         self.engine = init_db(db_uri)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self.Session = scoped_session(get_session_factory(self.engine))
+        self.sentiment = get_sentiment_engine(sentiment_processes)
+        self.calendar = calendar or get_calendar()
+        self.fetch_workers = fetch_workers
 
+    @timed_stage('read_rss')
     def read_rss(self):
         """
+        Fetch, parse and score outside any transaction, then write everything in one
+        short one, so concurrent shards on SQLite do not wait on each other's network
+        and scoring
         :return: True if successful
         """
+        pending = []
+        seen = set()
+
+        """Fetch all feeds concurrently, unchanged feeds answer 304"""
         with session_scope(self.engine) as session:
-            for stock in self.stocks:
-
-                """Init new Parser"""
-                feed = feedparser.parse(self.YAHOO_URL % stock)
-
-                for entry in feed.entries:
-
-                    """Check if news exists"""
-                    if session.query(News).filter_by(guid=entry.guid).first():
-                        continue
-
-                    """Analyze the sentiment"""
-                    sia = SentimentIntensityAnalyzer()
-                    _summary = sia.polarity_scores(entry.summary)['compound']
-                    _title = sia.polarity_scores(entry.title)['compound']
-
-                    """Parse the date"""
-                    pub_date = dt.datetime.strptime(entry.published, '%a, %d %b %Y %H:%M:%S +0000')
-                    p_date = f"{stock}_{pub_date.strftime('%Y-%m-%d')}"
-
-                    """Add new entry"""
-                    news_item = News(
-                        guid=entry.guid,
-                        stock=stock,
-                        title=entry.title,
-                        summary=entry.summary,
-                        published=pub_date,
-                        p_date=p_date,
-                        sentiment_summary=_summary,
-                        sentiment_title=_title
-                    )
-                    session.add(news_item)
+            states = load_states(session, self.stocks)
+        results = fetch_feeds(self.YAHOO_URL, states, max_workers=self.fetch_workers)
+
+        for result in results:
+            if result.error is not None:
+                print(f"Error fetching feed for {result.stock}: {result.error}")
+                continue
+            stock = result.stock
+
+            for entry in result.entries:
+
+                """Skip duplicates within this batch"""
+                if entry.guid in seen:
+                    continue
+                seen.add(entry.guid)
+
+                """Parse the date"""
+                pub_date = dt.datetime.strptime(entry.published, '%a, %d %b %Y %H:%M:%S +0000')
+                p_date = f"{stock}_{pub_date.strftime('%Y-%m-%d')}"
+
+                pending.append({
+                    'guid': entry.guid,
+                    'stock': stock,
+                    'title': entry.title,
+                    'summary': entry.summary,
+                    'published': pub_date,
+                    'p_date': p_date
+                })
+
+        """Check which news and texts are already stored with one query per chunk"""
+        with session_scope(self.engine) as session:
+            stored = existing_keys(session, News.guid, seen)
+            pending = [row for row in pending if row['guid'] not in stored]
+            texts = [row['title'] for row in pending] + [row['summary'] for row in pending]
+            known = load_scores(session, {text_key(text) for text in texts})
+
+        """Analyze the sentiment of all new entries in one batch, repeated texts are scored once"""
+        fresh = {}
+        scores = self.sentiment.score_batch(texts, stored=known, fresh=fresh)
+
+        """Bulk insert new entries"""
+        with session_scope(self.engine) as session:
+            save_scores(session, fresh)
+            save_states(session, results)
+            batch_id = open_batch(session) if pending else None
+            for i, row in enumerate(pending):
+                row['sentiment_title'] = scores[i]
+                row['sentiment_summary'] = scores[len(pending) + i]
+                row['batch_id'] = batch_id
+            insert_ignore(session, News, pending)
         return True
 
+    @timed_stage('summarize')
     def summarize(self):
         """
         Summarize news by day and get the Stock Value
         :return: <int> number of requests made
         """
 
-        session = self.Session()
-
-        """Count Requests"""
-        r_count = 0
+        prices = PriceClient(self.TRADING_URL, self.wt_key)
 
         with session_scope(self.engine) as session:
-            for news_item in session.query(News).all():
-                """Parse the Date and Find ID"""
-                check_date = self._get_check_date(news_item.published)
-                summary_id = f"{news_item.stock}_{news_item.published.strftime('%Y-%m-%d')}"
+            self._summarize_news(session)
+            update_rolling(session)
+        self._fill_prices(prices)
 
-                if session.query(Summary).filter_by(id=summary_id).first():
-                    continue
-
-                same_day_news = session.query(News).filter(News.p_date == news_item.p_date).all()
+        response_cache.invalidate()
+        return prices.requests_made
 
-                """Make Median and AVG"""
-                avg_summary, med_summary = self._median_avg([n.sentiment_summary for n in same_day_news])
-                avg_title, med_title = self._median_avg([n.sentiment_title for n in same_day_news])
+    def summarize_news(self):
+        """
+        Refresh the summaries of every stock day that received news, without prices
+        :return: <int> number of summaries written
+        """
+        with session_scope(self.engine) as session:
+            written = self._summarize_news(session)
+            update_rolling(session)
+        return written
 
-                """Add new entry"""
-                summary = Summary(
-                    id=summary_id,
-                    stock=news_item.stock,
-                    news_dt=news_item.published,
-                    check_day=check_date,
-                    change='UNCHECKED',
-                    sentiment_summary_avg=avg_summary,
-                    sentiment_summary_med=med_summary,
-                    sentiment_title_avg=avg_title,
-                    sentiment_title_med=med_title
-                )
-                session.add(summary)
+    def check_prices(self):
+        """
+        Fill open and close of this instance's unchecked summaries
+        :return: <int> number of requests made
+        """
+        prices = PriceClient(self.TRADING_URL, self.wt_key)
+        self._fill_prices(prices, self.stocks)
+        return prices.requests_made
 
-            """Update all 'UNCHECKED' columns"""
-            unchecked = session.query(Summary).filter(Summary.change == 'UNCHECKED').all()
+    def _fill_prices(self, prices, stocks=None):
+        """
+        Fill open and close of unchecked summaries before today. Price requests run
+        outside any transaction, each stock's bars are written in a short one.
+        :param prices: PriceClient
+        :param stocks: Only these stocks, None for all
+        """
+        """Group all 'UNCHECKED' summaries before today by stock"""
+        pending = {}
+        today = dt.datetime.combine(dt.date.today(), dt.time())
+        with session_scope(self.engine) as session:
+            unchecked = session.query(Summary).filter(
+                Summary.change == 'UNCHECKED',
+                Summary.check_day < today
+            )
+            if stocks is not None:
+                unchecked = unchecked.filter(Summary.stock.in_(stocks))
+            unchecked = unchecked.all()
+
+            """Move summaries assigned to a closed day before the calendar existed"""
+            closed = ~self.calendar.is_session([s.check_day for s in unchecked]) if unchecked else []
+            moved = [s for s, is_closed in zip(unchecked, closed) if is_closed]
+            for summary, check_day in zip(moved, self._get_check_dates([s.news_dt for s in moved])):
+                summary.check_day = pd.Timestamp(check_day).to_pydatetime()
 
-            """Go through all unchecked"""
             for summary in unchecked:
-                """If the check_day is not today, continue"""
-                if summary.check_day.date() >= dt.date.today():
+                if summary.check_day < today:
+                    pending.setdefault(summary.stock, []).append((summary.id, summary.check_day.date()))
+
+        """One cached range lookup per stock"""
+        for stock, summaries in pending.items():
+            bars = prices.get_bars(self.engine, stock, [day for _, day in summaries])
+
+            """Extract open and close"""
+            rows = []
+            for summary_id, day in summaries:
+                bar = bars.get(day)
+                if bar is None:
                     continue
+                rows.append({
+                    'id': summary_id,
+                    'open': bar.open,
+                    'close': bar.close,
+                    'high': bar.high,
+                    'low': bar.low,
+                    'volume': bar.volume,
+                    'change': 'win' if bar.close > bar.open else 'loss'
+                })
+            if rows:
+                with session_scope(self.engine) as session:
+                    session.execute(update(Summary), rows)
+
+    def _summarize_news(self, session):
+        """
+        Create or refresh the summaries of every stock day that received news
+        since the last run
+        :param session: Database session
+        :return: <int> number of summaries written
+        """
 
-                params = {
-                    'symbol': summary.stock,
-                    'date_from': summary.check_day.strftime('%Y-%m-%d'),
-                    'date_to': summary.check_day.strftime('%Y-%m-%d'),
-                    'api_token': self.wt_key
-                }
+        """Find the stock days of the batches committed since the last run"""
+        batch_ids = claim_batches(session, IngestBatch.summarized_at)
+        if not batch_ids:
+            return 0
+        dirty = self._chunked_in(session.query(News.p_date).distinct(), News.batch_id, batch_ids)
+        p_dates = list({row[0] for row in dirty})
+
+        """Aggregate all affected stock days"""
+        daily = self._aggregate_days(session, p_dates)
+
+        """Upsert summaries - late news refresh the sentiment of existing days"""
+        existing = {
+            s.id: s for s in self._chunked_in(session.query(Summary), Summary.id, p_dates)
+        }
+        check_days = self._get_check_dates(daily['news_dt'])
+        for row, check_day in zip(daily.itertuples(index=False), check_days):
+            summary = existing.get(row.p_date)
+            if summary is None:
+                summary = Summary(
+                    id=row.p_date,
+                    stock=row.stock,
+                    news_dt=pd.Timestamp(row.news_dt).to_pydatetime(),
+                    check_day=pd.Timestamp(check_day).to_pydatetime(),
+                    change='UNCHECKED'
+                )
+                session.add(summary)
+            summary.sentiment_summary_avg = float(row.summary_avg)
+            summary.sentiment_summary_med = float(row.summary_med)
+            summary.sentiment_title_avg = float(row.title_avg)
+            summary.sentiment_title_med = float(row.title_med)
 
-                r = requests.get(url=self.TRADING_URL, params=params)
-                r_count += 1
-
-                """Extract open and close"""
-                if r.status_code == 200:
-                    data = r.json()
-                    history = data.get('history', {})
-
-                    if history:
-                        day_data = history.get(summary.check_day.strftime('%Y-%m-%d'), {})
-                        if day_data:
-                            summary.open = float(day_data['open'])
-                            summary.close = float(day_data['close'])
-                            summary.high = float(day_data['high'])
-                            summary.low = float(day_data['low'])
-                            summary.volume = float(day_data['volume'])
-                            summary.change = 'win' if summary.close > summary.open else 'loss'
-        return r_count
+        ROWS_WRITTEN.inc(len(daily), table='summary')
+        return len(daily)
 
     @staticmethod
-    def _median_avg(values):
+    def _aggregate_days(session, p_dates):
         """
-        Return AVG and Median
-        :param values: Value Name
-        :return:
+        Average and median sentiment per stock day with a single GROUP BY
+        :param session: Database session
+        :param p_dates: list of p_date keys to aggregate
+        :return: DataFrame with one row per stock day
         """
-        if not values:
-            return 0.0, 0.0
-        avg = sum(values) / len(values)
-        med = median(values)
+        columns = ['stock', 'p_date', 'news_dt', 'summary_avg', 'summary_med', 'title_avg', 'title_med']
+        if not p_dates:
+            return pd.DataFrame(columns=columns)
+
+        if session.get_bind().dialect.name == 'postgresql':
+            summary_med = func.percentile_cont(0.5).within_group(News.sentiment_summary)
+            title_med = func.percentile_cont(0.5).within_group(News.sentiment_title)
+            query = session.query(
+                News.stock, News.p_date, func.min(News.published),
+                func.avg(News.sentiment_summary), summary_med,
+                func.avg(News.sentiment_title), title_med
+            ).group_by(News.stock, News.p_date)
+            rows = StockNews._chunked_in(query, News.p_date, p_dates)
+            return pd.DataFrame(rows, columns=columns)
+
+        """No median aggregate in SQLite - group the raw scores in pandas"""
+        query = session.query(
+            News.stock, News.p_date, News.published,
+            News.sentiment_summary, News.sentiment_title
+        )
+        news = pd.DataFrame(
+            StockNews._chunked_in(query, News.p_date, p_dates),
+            columns=['stock', 'p_date', 'published', 'summary', 'title']
+        )
+        daily = news.groupby(['stock', 'p_date']).agg(
+            news_dt=('published', 'min'),
+            summary_avg=('summary', 'mean'),
+            summary_med=('summary', 'median'),
+            title_avg=('title', 'mean'),
+            title_med=('title', 'median')
+        ).reset_index()
+        return daily[columns]
 
-        return avg, med
+    @staticmethod
+    def _chunked_in(query, column, values, chunk_size=500):
+        """
+        Run a query filtered by column IN values, in chunks
+        :return: list of rows
+        """
+        rows = []
+        for i in range(0, len(values), chunk_size):
+            rows.extend(query.filter(column.in_(values[i:i + chunk_size])).all())
+        return rows
 
     def _get_check_date(self, dt_check):
         """
@@ -170,72 +301,113 @@ class StockNews:
         :param dt_check: datetime
         :return: dt.datetime
         """
+        return pd.Timestamp(self._get_check_dates([dt_check])[0]).to_pydatetime()
 
-        """Get closing date"""
-        dt_close = dt.datetime(dt_check.year, dt_check.month, dt_check.day, self.closing_hour, self.closing_minute, 0)
-
-        """If the CheckDate is later than CloseDate, add one day"""
-        if dt_check > dt_close:
-            dt_check += dt.timedelta(days=1)
-
-        """If the CheckDate is a Saturday, add 2 days"""
-        if dt_check.weekday() == 5:
-            dt_check += dt.timedelta(days=2)
+    def _get_check_dates(self, news_dts):
+        """
+        Trading session to check for many news dates in one pass
+        :param news_dts: array-like of datetimes
+        :return: datetime64 array
+        """
+        return self.calendar.check_days(
+            pd.Series(news_dts, dtype='datetime64[ns]').to_numpy(),
+            self.closing_hour,
+            self.closing_minute
+        )
 
-        """If the CheckDate is a Sunday, add 1 day"""
-        if dt_check.weekday() == 6:
-            dt_check += dt.timedelta(days=1)
+    def get_summary(self, stock=None, start=None, end=None, cursor=None, limit=None, verbose=True):
+        """
+        Retrieve and display summary data from database, ordered by (check_day, id)
+        :param stock: Only this stock symbol
+        :param start: Only check days on or after this dt.date
+        :param end: Only check days on or before this dt.date
+        :param cursor: Continue after the row a previous page ended on
+        :param limit: Maximum number of rows
+        :param verbose: Print the result
+        :return: DataFrame, df.attrs['next_cursor'] is set when more rows may follow
+        """
+        data = []
+        last = None
+        for row in self.iter_summary(stock, start, end, cursor, limit):
+            last = row.pop('_key')
+            data.append(row)
 
-        """return date to check"""
-        return dt_check
+        df = pd.DataFrame(data)
+        if limit and len(data) == limit:
+            df.attrs['next_cursor'] = self.encode_cursor(last)
 
-    def get_summary(self):
-        """Retrieve and display summary data from database"""
-        with session_scope(self.engine) as session:
-            summaries = session.query(Summary).all()
-            data = [{
-                'id': s.id,
-                'stock': s.stock,
-                'news_date': s.news_dt.date(),
-                'check_date': s.check_day.date(),
-                #'open': s.open,
-                #'close': s.close,
-                #'change': s.change,
-                'sentiment_avg': s.sentiment_summary_avg
-            } for s in summaries]
-
-            df = pd.DataFrame(data)
+        if verbose:
             if df.empty:
                 print("No summary data available")
             else:
                 print(df.to_string(index=False))
-            return df
+        return df
+
+    def iter_summary(self, stock=None, start=None, end=None, cursor=None, limit=None, batch_size=1000):
+        """
+        Stream summary rows from a server-side cursor without loading the table
+        :param batch_size: Rows fetched from the database at a time
+        :return: generator of dictionaries, '_key' holds the keyset position of the row
+        """
+        query = select(
+            Summary.id, Summary.stock, Summary.news_dt, Summary.check_day, Summary.sentiment_summary_avg
+        ).order_by(Summary.check_day, Summary.id)
+
+        if stock:
+            query = query.where(Summary.stock == stock)
+        if start:
+            query = query.where(Summary.check_day >= dt.datetime.combine(start, dt.time()))
+        if end:
+            query = query.where(Summary.check_day < dt.datetime.combine(end + dt.timedelta(days=1), dt.time()))
+        if cursor:
+            check_day, summary_id = self.decode_cursor(cursor)
+            query = query.where(or_(
+                Summary.check_day > check_day,
+                and_(Summary.check_day == check_day, Summary.id > summary_id)
+            ))
+        if limit:
+            query = query.limit(limit)
+
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            for s in result:
+                yield {
+                    'id': s.id,
+                    'stock': s.stock,
+                    'news_date': s.news_dt.date().isoformat(),
+                    'check_date': s.check_day.date().isoformat(),
+                    #'open': s.open,
+                    #'close': s.close,
+                    #'change': s.change,
+                    'sentiment_avg': s.sentiment_summary_avg,
+                    '_key': (s.check_day, s.id)
+                }
+
+    @staticmethod
+    def encode_cursor(key):
+        """Opaque page cursor for a (check_day, id) position"""
+        check_day, summary_id = key
+        raw = json.dumps([check_day.isoformat(), summary_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode()
 
-    def cleanup_old_data(self):
-        """Remove all data older than today"""
-        today = dt.datetime.today().date()
-        session = self.Session()
-        
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        :return: (dt.datetime, str), raises ValueError for a malformed cursor
+        """
         try:
-            '''Delete news entries'''
-            session.query(News).filter(
-                func.date(News.published) < today
-            ).delete(synchronize_session=False)
-            
-            '''Delete summary entries'''
-            session.query(Summary).filter(
-                func.date(Summary.check_day) < today
-            ).delete(synchronize_session=False)
-            
-            '''Delete composite scores'''
-            session.query(CompositeScore).filter(
-                CompositeScore.date < today
-            ).delete(synchronize_session=False)
-            
-            session.commit()
-            print(f"\nRemoved all pre-{today} data")
+            check_day, summary_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return dt.datetime.fromisoformat(check_day), summary_id
         except Exception as e:
-            session.rollback()
-            print(f"Cleanup failed: {str(e)}")
-        finally:
-            session.close()
\ No newline at end of file
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    def cleanup_old_data(self, horizons=None, archive_dir=None, chunk_size=5000):
+        """
+        Remove data past its retention horizon, see retention.apply_retention
+        :param horizons: Dictionary of table -> days to keep, None for the configured defaults
+        :param archive_dir: Archive removed rows as Parquet here first
+        :param chunk_size: Rows deleted per transaction
+        :return: Dictionary of table -> rows deleted
+        """
+        from .retention import apply_retention
+        return apply_retention(self.db_uri, horizons, chunk_size, archive_dir)
@@ -1,18 +1,31 @@
+import os
+import subprocess
+import sys
+import itertools
+import threading
+import time
 import pytest
 import json
 from unittest.mock import patch, MagicMock
 from datetime import datetime, timedelta
 import pandas as pd
-from sqlalchemy import create_engine
-from stock_news import StockNews
 
-from app import app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from backend.app import create_app
+from backend.cache import response_cache
+from backend.composite import save_composite_score
+from backend.events import score_events
+'''Imported before any test patches backend.stock_news.StockNews, which it binds at import'''
+from backend.ingest import ShardedIngest
+
+app = create_app({'TESTING': True, 'DB_URI': 'sqlite:///:memory:'})
+jobs = app.extensions['jobs']
 
 @pytest.fixture
 def client():
     """Configure Flask test client with in-memory database."""
-    app.config['TESTING'] = True
-    app.config['DB_URI'] = 'sqlite:///:memory:'
+    response_cache.clear()
     with app.test_client() as client:
         yield client
 
@@ -24,7 +37,7 @@ def test_fetch_news_success(client):
     """Test successful news fetching with valid stock list."""
     test_data = {'stocks': ['AAPL', 'MSFT']}
     
-    with patch('app.StockNews') as mock_stocknews:
+    with patch('backend.stock_news.StockNews') as mock_stocknews:
         mock_instance = mock_stocknews.return_value
         mock_instance.read_rss.return_value = None
         
@@ -40,7 +53,7 @@ def test_fetch_news_empty_stocks(client):
 
 def test_fetch_news_error_handling(client):
     """Test error handling in news endpoint."""
-    with patch('app.StockNews') as mock_stocknews:
+    with patch('backend.stock_news.StockNews') as mock_stocknews:
         mock_instance = mock_stocknews.return_value
         mock_instance.read_rss.side_effect = Exception("Test error")
         
@@ -58,7 +71,7 @@ def test_get_summary_success(client):
         'negative': [2]
     })
     
-    with patch('app.StockNews') as mock_stocknews:
+    with patch('backend.stock_news.StockNews') as mock_stocknews:
         mock_instance = mock_stocknews.return_value
         mock_instance.get_summary.return_value = mock_summary
         
@@ -68,6 +81,36 @@ def test_get_summary_success(client):
         assert isinstance(data, list)
         assert len(data) == 1
 
+def test_get_summary_pagination(client):
+    """Test keyset pagination and NDJSON streaming of summaries."""
+    from backend.database import get_engine, session_scope
+    from backend.db_models import Summary
+
+    with session_scope(get_engine(app.config['DB_URI'])) as session:
+        session.query(Summary).delete()
+        for day in range(1, 6):
+            session.add(Summary(
+                id=f"AAPL_2024-01-0{day}",
+                stock='AAPL',
+                news_dt=datetime(2024, 1, day, 9),
+                check_day=datetime(2024, 1, day, 16),
+                sentiment_summary_avg=0.1 * day
+            ))
+
+    first = client.get('/summary?limit=2')
+    assert [row['id'] for row in first.json] == ['AAPL_2024-01-01', 'AAPL_2024-01-02']
+    cursor = first.headers['X-Next-Cursor']
+
+    second = client.get(f'/summary?limit=2&cursor={cursor}')
+    assert [row['id'] for row in second.json] == ['AAPL_2024-01-03', 'AAPL_2024-01-04']
+
+    stream = client.get('/summary?format=ndjson&start=2024-01-04')
+    assert stream.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in stream.data.decode().splitlines()]
+    assert [row['check_date'] for row in rows] == ['2024-01-04', '2024-01-05']
+
+    assert client.get('/summary?cursor=bad').status_code == 400
+
 def test_composite_score_success(client):
     """Test successful composite score retrieval."""
     mock_df = pd.DataFrame({
@@ -75,7 +118,7 @@ def test_composite_score_success(client):
         'score': [0.85]
     }, index=[datetime.today()])
     
-    with patch('app.get_composite_score') as mock_composite:
+    with patch('backend.composite.get_stored_scores') as mock_composite:
         mock_composite.return_value = mock_df
         
         response = client.get('/composite-score')
@@ -84,6 +127,162 @@ def test_composite_score_success(client):
         assert 'scores' in data
         assert len(data['scores']) == 1
 
+def test_stream_scores(client):
+    """Test that saved composite scores are pushed to stream subscribers."""
+    scores_df = pd.DataFrame({
+        'stock': ['AAPL'], 'sentiment': [0.2], 'vix': [18.0], 'composite_score': [58.0]
+    })
+    save_composite_score(app.config['DB_URI'], scores_df)
+
+    response = client.get('/stream/scores', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    latest = next(chunks).decode()
+    assert 'event: scores' in latest
+    assert json.loads(latest.split('data: ', 1)[1])['scores'][0]['stock'] == 'AAPL'
+
+    score_events.publish('scores', {'scores': [{'stock': 'MSFT'}]})
+    assert '"MSFT"' in next(chunks).decode()
+    response.close()
+
+def test_stream_scores_from_other_workers(client, monkeypatch):
+    """Test that streams pick up scores another worker saved, without an in-process publish."""
+    from backend import app as app_module
+    from backend.database import get_engine, session_scope
+    from backend.db_models import CompositeScore
+
+    monkeypatch.setattr(app_module, 'SSE_POLL_SECONDS', 0.05)
+    save_composite_score(app.config['DB_URI'], pd.DataFrame({
+        'stock': ['AAPL'], 'sentiment': [0.2], 'vix': [18.0], 'composite_score': [58.0]
+    }))
+    response = client.get('/stream/scores', buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    seen = next(chunks).decode()
+    last_id = seen.split('\n', 1)[0].split(': ', 1)[1]
+
+    '''A save by another process only reaches this one through the database'''
+    with session_scope(get_engine(app.config['DB_URI'])) as session:
+        session.add(CompositeScore(stock='NVDA', date=datetime(2024, 3, 8).date(), sentiment=0.1,
+                                   vix=20.0, composite_score=55.0, saved_at=datetime.utcnow()))
+    pushed = next(chunks).decode()
+    assert '"NVDA"' in pushed and '"2024-03-08"' in pushed
+
+    response.close()
+
+    '''Every stream of the process shares one poller'''
+    other = client.get('/stream/scores', buffered=False)
+    assert '"NVDA"' in b''.join(itertools.islice(other.response, 2)).decode()
+    assert [t.name for t in threading.enumerate()].count('broker-poll') == 1
+    other.close()
+
+    '''A reconnecting client that saw it gets nothing until the next save'''
+    pushed_id = pushed.split('\n', 1)[0].split(': ', 1)[1]
+    assert int(pushed_id) > int(last_id)
+    response = client.get('/stream/scores', buffered=False, headers={'Last-Event-ID': pushed_id})
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    monkeypatch.setattr(app_module, 'SSE_HEARTBEAT_SECONDS', 0.1)
+    assert next(chunks) == b': keepalive\n\n'
+    response.close()
+
+def test_intraday_composite_score(client):
+    """Test that rolling sentiment folds in new and late news without a rescan."""
+    from backend.batches import open_batch
+    from backend.database import get_engine, session_scope
+    from backend.db_models import News
+    from backend.rolling import update_rolling
+
+    engine = get_engine(app.config['DB_URI'])
+    t0 = datetime(2024, 3, 4, 9)
+
+    def add(guid, published, sentiment):
+        with session_scope(engine) as session:
+            session.add(News(guid=guid, stock='TSLA', title='', summary='', published=published,
+                             p_date=f"TSLA_{published:%Y-%m-%d}", sentiment_summary=sentiment,
+                             sentiment_title=sentiment, batch_id=open_batch(session)))
+        with session_scope(engine) as session:
+            update_rolling(session, half_life_hours=12)
+
+    add('tsla-1', t0, 0.5)
+    add('tsla-2', t0 + timedelta(hours=12), -0.5)
+    '''Late headline, published before the newest one'''
+    add('tsla-3', t0, 0.2)
+
+    with patch('backend.composite.get_macro_data') as mock_macro:
+        mock_macro.return_value = {'vix': 20.0}
+        response = client.get('/composite-score/intraday?stocks=tsla')
+
+    assert response.status_code == 200
+    score = response.json['scores'][0]
+    assert score['stock'] == 'TSLA' and score['news'] == 3
+    assert score['sentiment'] == pytest.approx((0.5 * 0.5 - 0.5 + 0.2 * 0.5) / (0.5 + 1 + 0.5))
+
+def test_summarize_news_incremental():
+    """Test that late headlines refresh their summary and an idle run writes nothing."""
+    from backend.database import get_engine, session_scope
+    from backend.db_models import IngestBatch, News, Summary
+    from backend.stock_news import StockNews
+
+    engine = get_engine(app.config['DB_URI'])
+    stock_news = StockNews(stocks=[], db_uri=app.config['DB_URI'])
+    published = datetime(2024, 3, 5, 10)
+
+    def add(guid, sentiment, batch_id):
+        with session_scope(engine) as session:
+            session.add(IngestBatch(id=batch_id, created_at=datetime.utcnow()))
+            session.add(News(guid=guid, stock='IBM', title='', summary='', published=published,
+                             p_date='IBM_2024-03-05', sentiment_summary=sentiment,
+                             sentiment_title=sentiment, batch_id=batch_id))
+
+    def summary_avg():
+        with session_scope(engine) as session:
+            return session.get(Summary, 'IBM_2024-03-05').sentiment_summary_avg
+
+    add('ibm-1', 0.4, 1000)
+    assert stock_news.summarize_news() >= 1
+    assert summary_avg() == pytest.approx(0.4)
+
+    '''Committed after the run with a lower batch id, as concurrent writers do'''
+    add('ibm-2', -0.2, 999)
+    assert stock_news.summarize_news() == 1
+    assert summary_avg() == pytest.approx(0.1)
+
+    assert stock_news.summarize_news() == 0
+    assert summary_avg() == pytest.approx(0.1)
+
+def test_stock_news_shares_sentiment_engine():
+    """Test that StockNews instances reuse one sentiment pool per process."""
+    from backend.stock_news import StockNews
+
+    first = StockNews(stocks=[], db_uri=app.config['DB_URI'], sentiment_processes=4)
+    second = StockNews(stocks=[], db_uri=app.config['DB_URI'], sentiment_processes=4)
+    assert first.sentiment is second.sentiment
+    assert first.sentiment._pool is None
+
+def test_composite_score_conditional(client):
+    """Test that composite scores are cached and revalidated with ETag."""
+    mock_df = pd.DataFrame({'stock': ['AAPL'], 'composite_score': [55.0]})
+
+    with patch('backend.composite.get_stored_scores') as mock_composite:
+        mock_composite.return_value = mock_df
+
+        first = client.get('/composite-score')
+        etag = first.headers['ETag']
+        assert first.headers['Last-Modified']
+
+        second = client.get('/composite-score', headers={'If-None-Match': etag})
+        assert second.status_code == 304
+        assert mock_composite.call_count == 1
+
+        '''Writes invalidate the cache'''
+        response_cache.invalidate()
+        mock_df.loc[0, 'composite_score'] = 60.0
+        third = client.get('/composite-score', headers={'If-None-Match': etag})
+        assert third.status_code == 200
+        assert third.headers['ETag'] != etag
+
 def test_historical_scores_success(client):
     """Test historical scores with valid days parameter."""
     mock_data = pd.DataFrame({
@@ -92,7 +291,7 @@ def test_historical_scores_success(client):
         'composite_score': [0.85]
     })
     
-    with patch('app.get_historical') as mock_historical:
+    with patch('backend.composite.get_historical') as mock_historical:
         mock_historical.return_value = mock_data
         
         response = client.get('/historical-scores?days=7')
@@ -111,8 +310,8 @@ def test_run_full_analysis(client):
         'date': [datetime.today().strftime('%Y-%m-%d')]
     })
     
-    with patch('app.StockNews') as mock_stocknews, \
-         patch('app.get_composite_score') as mock_composite_func:
+    with patch('backend.stock_news.StockNews') as mock_stocknews, \
+         patch('backend.composite.get_composite_score') as mock_composite_func:
 
         mock_instance = mock_stocknews.return_value
         mock_instance.read_rss.return_value = None  # Add this line
@@ -120,10 +319,122 @@ def test_run_full_analysis(client):
 
         response = client.post('/run-analysis', json={'stocks': test_stocks})
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         data = json.loads(response.data)
-        assert data['status'] == "success"
-        assert len(data['composite_scores']) == 1
+        assert data['status'] == "accepted"
+
+        '''Wait for the background job and poll its status'''
+        assert jobs.get(data['job_id']).wait(timeout=5)
+        response = client.get(f"/jobs/{data['job_id']}")
+        assert response.status_code == 200
+        job = json.loads(response.data)
+        assert job['status'] == "succeeded"
+        assert [s['name'] for s in job['stages']] == ['read_rss', 'summarize', 'composite_score']
+        assert len(job['result']) == 1
+
+def test_run_full_analysis_shards(client):
+    """Test that the shard count is validated and capped."""
+    response = client.post('/run-analysis', json={'stocks': ['AAPL'], 'shards': 'many'})
+    assert response.status_code == 400
+
+    with patch('backend.ingest.MAX_SHARDS', 2), \
+         patch('backend.ingest.ShardedIngest') as mock_ingest, \
+         patch.object(jobs, 'submit', return_value=(MagicMock(id='j', to_dict=dict), True)):
+        response = client.post('/run-analysis', json={'stocks': ['AAPL', 'MSFT', 'NVDA'], 'shards': 5000})
+    assert response.status_code == 202
+    assert mock_ingest.call_args.kwargs['shards'] == 2
+
+def test_run_full_analysis_merges_duplicates(client):
+    """Test that a running job absorbs submissions for the same stocks."""
+    release = threading.Event()
+
+    with patch('backend.stock_news.StockNews') as mock_stocknews, \
+         patch('backend.composite.get_composite_score') as mock_composite_func:
+
+        mock_stocknews.return_value.read_rss.side_effect = lambda: release.wait(5)
+        mock_composite_func.return_value = pd.DataFrame()
+
+        first = json.loads(client.post('/run-analysis', json={'stocks': ['MSFT', 'AAPL']}).data)
+        second = json.loads(client.post('/run-analysis', json={'stocks': ['AAPL', 'MSFT']}).data)
+        release.set()
+
+        assert second['job_id'] == first['job_id']
+        assert second['status'] == "running"
+        assert jobs.get(first['job_id']).wait(timeout=5)
+
+class FakeAnalyzer:
+    """Stands in for VADER, whose lexicon the tests do not download."""
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+
+    def polarity_scores(self, text):
+        time.sleep(self.seconds)
+        return {'compound': (len(text) % 21) / 10 - 1}
+
+def test_sharded_ingest_sqlite(tmp_path, monkeypatch):
+    """Test that shard processes share one SQLite file without lock errors."""
+    from backend import sentiment, upstream
+    from backend.benchmarks.server import StandInConfig, StandInServer
+    from backend.database import get_engine, session_scope
+    from backend.db_models import News, Summary
+
+    '''Forked workers inherit a slow stand-in analyzer, unlimited upstream clients
+    and a busy timeout shorter than a shard's scoring and price requests'''
+    monkeypatch.setattr('backend.ingest.START_METHOD', 'fork')
+    monkeypatch.setattr('backend.ingest.MAX_SHARDS', 4)
+    monkeypatch.setattr(sentiment, '_analyzer', FakeAnalyzer(seconds=0.002))
+    monkeypatch.setattr(upstream, '_clients', {})
+    for service in upstream.SERVICES:
+        monkeypatch.setenv(f'UPSTREAM_{service.upper()}_RATE', '0')
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT', '1')
+
+    db_uri = f"sqlite:///{tmp_path / 'ingest.db'}"
+    stocks = [f"T{i:03d}" for i in range(200)]
+    with StandInServer(StandInConfig(items=10, days=10, latency_ms=30)) as server:
+        ingest = ShardedIngest(stocks, wt_key='test', db_uri=db_uri, shards=4)
+        assert len(ingest.shards) == 4
+        ingest.YAHOO_URL = server.base_url + '/rss?s=%s'
+        ingest.TRADING_URL = server.base_url + '/history'
+        assert ingest.read_rss()
+        ingest.summarize()
+
+    today = datetime.combine(datetime.today().date(), datetime.min.time())
+    with session_scope(get_engine(db_uri)) as session:
+        assert session.query(News).count() == 200 * 10
+        checked = session.query(Summary).filter(Summary.check_day < today)
+        assert checked.count() > 0
+        assert checked.filter(Summary.change == 'UNCHECKED').count() == 0
+
+def test_jobs_shared_across_workers(tmp_path):
+    """Test that another worker process answers job status and merges duplicates."""
+    from backend.jobs import JobRunner
+    from backend.job_store import JobStore
+
+    db_uri = f"sqlite:///{tmp_path / 'jobs.db'}"
+    worker_a = JobRunner(store=JobStore(db_uri))
+    worker_b = JobRunner(store=JobStore(db_uri))
+    release = threading.Event()
+
+    job, created = worker_a.submit(('AAPL', 'MSFT'), [
+        ('read_rss', lambda _: release.wait(5)),
+        ('composite_score', lambda _: [{'stock': 'AAPL'}])
+    ])
+    merged, merged_created = worker_b.submit(('AAPL', 'MSFT'), [('read_rss', lambda _: None)])
+    assert created and not merged_created
+    assert merged.id == job.id
+    assert worker_b.get(job.id).to_dict()['status'] in ('queued', 'running')
+
+    release.set()
+    assert job.wait(timeout=5)
+    status = worker_b.get(job.id).to_dict()
+    assert status['status'] == 'succeeded'
+    assert [stage['status'] for stage in status['stages']] == ['succeeded', 'succeeded']
+    assert status['result'] == [{'stock': 'AAPL'}]
+
+    '''The key is released once the job finishes'''
+    _, created = worker_b.submit(('AAPL', 'MSFT'), [('read_rss', lambda _: None)])
+    assert created
+    assert worker_a.get('unknown') is None
 
 '''def test_run_full_analysis(client):
     """Test full analysis workflow."""
@@ -141,9 +452,9 @@ def test_run_full_analysis(client):
         'composite_score': [0.8]
     })
     
-    with patch('app.StockNews') as mock_stocknews, \
-         patch('app.get_composite_score') as mock_composite_func, \
-         patch('app.get_historical') as mock_historical_func:
+    with patch('backend.stock_news.StockNews') as mock_stocknews, \
+         patch('backend.composite.get_composite_score') as mock_composite_func, \
+         patch('backend.composite.get_historical') as mock_historical_func:
 
         mock_instance = mock_stocknews.return_value
         mock_instance.summarize.return_value = 5
@@ -167,7 +478,7 @@ def test_run_full_analysis(client):
 
 def test_composite_score_empty(client):
     """Test composite score endpoint with empty data."""
-    with patch('app.get_composite_score') as mock_composite:
+    with patch('backend.composite.get_stored_scores') as mock_composite:
         mock_composite.return_value = pd.DataFrame()
         
         response = client.get('/composite-score')
@@ -175,7 +486,423 @@ def test_composite_score_empty(client):
         data = json.loads(response.data)
         assert "No composite scores" in data['message']
 
+def test_job_status_unknown(client):
+    """Test job status with an unknown id."""
+    response = client.get('/jobs/unknown')
+    assert response.status_code == 404
+
+def test_metrics(client):
+    """Test Prometheus metrics exposition."""
+    client.get('/jobs/unknown')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.data.decode()
+    assert '# TYPE mmd_http_request_seconds histogram' in body
+    assert 'mmd_http_requests_total{method="GET",route="/jobs/<job_id>",status="404"}' in body
+
 def test_historical_scores_invalid_days(client):
     """Test historical scores with invalid days parameter."""
     response = client.get('/historical-scores?days=invalid')
-    assert response.status_code == 400  # Bad request
\ No newline at end of file
+    assert response.status_code == 400  # Bad request
+
+# --------------------------
+# Import Time
+# --------------------------
+
+IMPORT_BUDGET_SECONDS = 0.5
+
+def test_import_budget():
+    """Test that importing the app is fast and leaves the pipeline stack unloaded."""
+    code = (
+        "import sys, time; t0 = time.perf_counter(); import backend.app; "
+        "print(time.perf_counter() - t0); "
+        "print(','.join(m for m in ('pandas', 'numpy', 'nltk', 'feedparser', 'sqlalchemy') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True, text=True, check=True
+    )
+    seconds, heavy = result.stdout.splitlines()
+    assert heavy == ''
+    assert float(seconds) < IMPORT_BUDGET_SECONDS
+
+def test_upstream_retries_429():
+    """Test that a 429 is retried after its Retry-After and given up on after the retries."""
+    from backend.upstream import UpstreamClient
+
+    def response(status, retry_after=None):
+        return MagicMock(status_code=status, headers={'Retry-After': retry_after} if retry_after else {})
+
+    client = UpstreamClient('test', retries=2)
+    delays = []
+    with patch('backend.upstream.time.sleep', side_effect=delays.append), \
+         patch.object(client.http, 'get', side_effect=[response(429, '3'), response(200)]) as get:
+        assert client.get('http://upstream/').status_code == 200
+    assert get.call_count == 2 and delays == [3]
+    assert client.bucket.paused_until > 0
+
+    client = UpstreamClient('test', retries=2)
+    delays = []
+    with patch('backend.upstream.time.sleep', side_effect=delays.append), \
+         patch.object(client.http, 'get', return_value=response(429, '3')) as get:
+        assert client.get('http://upstream/').status_code == 429
+    assert get.call_count == 3 and delays == [3, 3]
+
+def test_upstream_releases_slot_on_request_errors():
+    """Test that any request error frees its concurrency slot, and only transient ones are retried."""
+    import requests
+    from backend.upstream import UpstreamClient
+
+    client = UpstreamClient('test', max_concurrency=2, retries=1)
+    with patch('backend.upstream.time.sleep'), \
+         patch.object(client.http, 'get', side_effect=requests.exceptions.ChunkedEncodingError()) as get:
+        for _ in range(3):
+            with pytest.raises(requests.exceptions.ChunkedEncodingError):
+                client.get('http://upstream/')
+    assert get.call_count == 3 * 2
+    assert client.limiter.active == 0
+
+    with patch.object(client.http, 'get', side_effect=requests.exceptions.InvalidURL()) as get:
+        with pytest.raises(requests.exceptions.InvalidURL):
+            client.get('upstream')
+    assert get.call_count == 1 and client.limiter.active == 0
+
+def test_shards_split_upstream_limits(monkeypatch):
+    """Test that shard workers together stay within the parent's upstream limits."""
+    from backend import upstream
+
+    monkeypatch.setattr(upstream, '_clients', {})
+    monkeypatch.delenv('UPSTREAM_YAHOO_RATE', raising=False)
+    upstream.configure('fred', rate=None)
+
+    shares = upstream.split_limits(upstream.limits(), 4)
+    assert shares['yahoo'] == {'rate': 2.5, 'burst': 5, 'max_concurrency': 4}
+    assert shares['worldtradingdata'] == {'rate': 1.25, 'burst': 2.5, 'max_concurrency': 2}
+    assert shares['fred']['rate'] is None
+
+    upstream.configure('yahoo', **shares['yahoo'])
+    assert upstream.get_client('yahoo').bucket.rate == 2.5
+
+def price_history_db(path):
+    """SQLite file with 20 days of bars from 2024-02-01 for two symbols"""
+    from datetime import date
+    from backend.database import init_db, session_scope
+    from backend.db_models import PriceBar
+
+    engine = init_db(f"sqlite:///{path}")
+    with session_scope(engine) as session:
+        for symbol in ('AAPL', 'MSFT'):
+            for i in range(20):
+                session.add(PriceBar(symbol=symbol, day=date(2024, 2, 1) + timedelta(days=i), open=1.0,
+                                     close=1.0, high=1.0, low=1.0, volume=1.0, fetched_at=datetime(2024, 3, 1)))
+    return engine
+
+def test_purge_table_chunks(tmp_path):
+    """Test that retention deletes only rows past the cutoff, chunk by chunk."""
+    from datetime import date
+    from backend.database import session_scope
+    from backend.db_models import PriceBar
+    from backend.retention import purge_table
+
+    engine = price_history_db(tmp_path / 'retention.db')
+
+    '''Cutoff 2024-02-11, the rows dated on it are kept'''
+    assert purge_table(engine, 'price_bars', days=20, chunk_size=3, today=date(2024, 3, 2)) == 2 * 10
+    with session_scope(engine) as session:
+        assert session.query(PriceBar).count() == 2 * 10
+        assert min(bar.day for bar in session.query(PriceBar)) == date(2024, 2, 11)
+    assert purge_table(engine, 'price_bars', days=20, chunk_size=3, today=date(2024, 3, 2)) == 0
+
+def test_purge_table_archives(tmp_path):
+    """Test that purged rows are archived to Parquet, one partition per day."""
+    pytest.importorskip('pyarrow')
+    from datetime import date
+    from backend.retention import purge_table
+
+    engine = price_history_db(tmp_path / 'retention.db')
+    archive = tmp_path / 'archive'
+    deleted = purge_table(engine, 'price_bars', days=20, chunk_size=3,
+                          archive_dir=str(archive), today=date(2024, 3, 2))
+
+    archived = pd.concat(pd.read_parquet(path) for path in archive.glob('price_bars/*/*.parquet'))
+    assert deleted == len(archived) == 2 * 10
+    assert archived['day'].max() == date(2024, 2, 10)
+    assert len(list(archive.glob('price_bars/archive_date=*'))) == 10
+
+def test_check_days_holidays_and_early_closes():
+    """Test that check days skip holidays, honour early closes and keep news at the close."""
+    from backend.trading_calendar import get_calendar
+
+    news = [
+        datetime(2024, 3, 29, 10),      # Good Friday
+        datetime(2024, 3, 28, 20, 30),  # after Thursday's close, Friday is closed
+        datetime(2024, 7, 3, 16, 59),   # before the 17:00 early close
+        datetime(2024, 7, 3, 18),       # after the early close, July 4th is closed
+        datetime(2024, 11, 29, 17),     # exactly at an early close
+        datetime(2024, 3, 4, 20),       # exactly at the close
+        datetime(2024, 3, 4, 20, 1),
+        datetime(2024, 3, 9, 12),       # Saturday
+    ]
+    days = get_calendar().check_days(news, closing_hour=20)
+    assert [pd.Timestamp(day).date().isoformat() for day in days] == [
+        '2024-04-01', '2024-04-01', '2024-07-03', '2024-07-05',
+        '2024-11-29', '2024-03-04', '2024-03-05', '2024-03-11'
+    ]
+    '''The time of day is kept'''
+    assert pd.Timestamp(days[0]).to_pydatetime() == datetime(2024, 4, 1, 10)
+
+BASELINE_SCHEMA = """
+CREATE TABLE news (guid VARCHAR NOT NULL, stock VARCHAR, title VARCHAR, summary VARCHAR, published DATETIME,
+    p_date VARCHAR, sentiment_summary FLOAT, sentiment_title FLOAT, PRIMARY KEY (guid));
+CREATE TABLE summary (id VARCHAR NOT NULL, stock VARCHAR, news_dt DATETIME, check_day DATETIME, open FLOAT,
+    close FLOAT, high FLOAT, low FLOAT, volume FLOAT, change VARCHAR, sentiment_summary_avg FLOAT,
+    sentiment_summary_med FLOAT, sentiment_title_avg FLOAT, sentiment_title_med FLOAT, PRIMARY KEY (id));
+CREATE TABLE composite_scores (id INTEGER NOT NULL, stock VARCHAR, date DATE, sentiment FLOAT, vix FLOAT,
+    composite_score FLOAT, PRIMARY KEY (id));
+"""
+
+def baseline_db(path):
+    """SQLite file with the schema of the first release and a few rows"""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO news VALUES ('g1', 'AAPL', 't', 's', '2024-03-04 10:00:00.000000', "
+                 "'AAPL_2024-03-04', 0.5, 0.1)")
+    conn.executemany("INSERT INTO composite_scores VALUES (?, ?, ?, ?, ?, ?)", [
+        (1, 'AAPL', '2024-03-04', 0.1, 18.0, 50.0),
+        (2, 'AAPL', '2024-03-04', 0.2, 18.0, 60.0),
+        (3, 'MSFT', '2024-03-04', 0.3, 18.0, 70.0),
+    ])
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{path}"
+
+def test_concurrent_migrations(tmp_path):
+    """Test that processes starting together on an old database migrate it once without errors."""
+    db_uri = baseline_db(tmp_path / 'baseline.db')
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'backend.migrations', db_uri],
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for _ in range(4)
+    ]
+    for worker in workers:
+        _, err = worker.communicate(timeout=60)
+        assert worker.returncode == 0, err.decode()
+
+def test_response_cache_versions():
+    """Test that Last-Modified follows the data and a build racing a write is not cached."""
+    from backend.cache import ResponseCache
+
+    cache = ResponseCache(ttl=0)
+    data = {'score': 1}
+    _, _, _, etag, first = cache.get('k', lambda: (dict(data), 200))
+    _, _, _, same_etag, same = cache.get('k', lambda: (dict(data), 200))
+    assert (same_etag, same) == (etag, first)
+
+    '''Another worker changed the data, the entry expired and is rebuilt'''
+    data['score'] = 2
+    _, _, _, new_etag, modified = cache.get('k', lambda: (dict(data), 200))
+    assert new_etag != etag and modified > first
+
+    cache = ResponseCache(ttl=60)
+
+    def racing_build():
+        payload = dict(data)
+        cache.invalidate()
+        return payload, 200
+
+    cache.get('k', racing_build)
+    data['score'] = 3
+    assert cache.get('k', lambda: (dict(data), 200))[0] == {'score': 3}
+
+def test_if_modified_since_sees_other_workers(client):
+    """Test that a client revalidating by date gets changed scores after the cache expires."""
+    payload = {'scores': [1]}
+    with patch('backend.composite.get_stored_scores') as mock_scores, \
+         patch.object(response_cache, 'ttl', 0):
+        mock_scores.side_effect = lambda db_uri: pd.DataFrame({'stock': ['AAPL'], 'score': payload['scores']})
+        first = client.get('/composite-score')
+        payload['scores'] = [2]
+        again = client.get('/composite-score', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 200 and again.json['scores'][0]['score'] == 2
+
+def test_backtest_history_ignores_collation():
+    """Test that backtest groups do not depend on the order the database returns rows in."""
+    from backend.backtest import load_history, stock_stats
+
+    '''en_US collation puts BFA before BF.B, code point order the other way round'''
+    rows = pd.DataFrame({
+        'stock': ['BFA', 'BFA', 'BF.B', 'BF.B', 'BF.B'],
+        'check_day': pd.to_datetime(['2024-03-04', '2024-03-05', '2024-03-04', '2024-03-05', '2024-03-06']),
+        'sentiment_summary_avg': [0.2, -0.1, 0.3, 0.1, -0.2],
+        'open': [10.0, 10.0, 20.0, 20.0, 20.0],
+        'close': [11.0, 9.0, 21.0, 19.0, 19.0]
+    })
+    with patch('backend.backtest.pd.read_sql', return_value=rows):
+        history = load_history('sqlite:///:memory:')
+
+    assert list(history.symbols) == ['BF.B', 'BFA']
+    assert list(history.group) == [0, 0, 0, 1, 1]
+    stats = stock_stats(history).set_index('stock')
+    assert stats.loc['BF.B', 'days'] == 3 and stats.loc['BFA', 'hit_rate'] == 1.0
+
+def test_benchmark_repeats_score_cold(monkeypatch):
+    """Test that every benchmark run scores its texts and the run leaves globals as it found them."""
+    from backend import fred, sentiment, upstream
+    from backend.benchmarks.run import run
+
+    analyzer = FakeAnalyzer()
+    calls = []
+    monkeypatch.setattr(analyzer, 'polarity_scores', lambda text: calls.append(text) or {'compound': 0.0})
+    monkeypatch.setattr(sentiment, '_analyzer', analyzer)
+    fred_url, clients = fred.FRED_URL, upstream.clients()
+
+    report = run(tickers=2, items=3, days=5, repeats=2)
+    assert report['read_rss']['rows'] == 2 * 3
+
+    '''Two timed runs and the traced run, each scoring titles and summaries'''
+    assert len(calls) >= 3 * 2 * 3
+    assert fred.FRED_URL == fred_url and upstream.clients() == clients
+
+def test_fred_refresh_ttl_and_incremental(tmp_path):
+    """Test that FRED is asked once per TTL and only for dates after the cached ones."""
+    from datetime import date
+    from backend.database import init_db, session_scope
+    from backend.fred import get_observations, refresh_series
+
+    engine = init_db(f"sqlite:///{tmp_path / 'fred.db'}")
+    today = date.today()
+    start = today - timedelta(days=10)
+    response = MagicMock(status_code=200)
+    response.json.return_value = {'observations': [
+        {'date': (start + timedelta(days=i)).isoformat(), 'value': '.' if i == 1 else f'{20 + i}'}
+        for i in range(3)
+    ]}
+
+    with patch('backend.fred.get_client') as get_client:
+        get = get_client.return_value.get
+        get.return_value = response
+        with session_scope(engine) as session:
+            assert refresh_series(session, 'VIXCLS', 'key', start)
+        with session_scope(engine) as session:
+            assert not refresh_series(session, 'VIXCLS', 'key', start)
+        assert get.call_count == 1
+        assert get.call_args.kwargs['params']['observation_start'] == start.isoformat()
+
+        '''Past the TTL only the dates after the newest cached one are requested'''
+        response.json.return_value = {'observations': []}
+        with session_scope(engine) as session:
+            assert refresh_series(session, 'VIXCLS', 'key', start, ttl=0)
+        assert get.call_count == 2
+        assert get.call_args.kwargs['params']['observation_start'] == (start + timedelta(days=3)).isoformat()
+
+    with session_scope(engine) as session:
+        assert get_observations(session, 'VIXCLS', start, today) == [(start, 20.0), (start + timedelta(days=2), 22.0)]
+
+def test_upgrade_baseline_database(tmp_path):
+    """Test that an old database with duplicate scores is upgraded to the current schema, twice safely."""
+    from sqlalchemy import create_engine, inspect
+    from backend.database import session_scope
+    from backend.db_models import CompositeScore, DailyScore, IngestBatch, News
+    from backend.migrations import upgrade
+
+    engine = create_engine(baseline_db(tmp_path / 'baseline.db'))
+    upgrade(engine)
+    upgrade(engine)
+
+    inspector = inspect(engine)
+    assert 'uq_composite_scores_stock_date' in {ix['name'] for ix in inspector.get_indexes('composite_scores')}
+    assert 'batch_id' in {c['name'] for c in inspector.get_columns('news')}
+    with session_scope(engine) as session:
+        '''The latest row of each (stock, date) is kept'''
+        scores = {s.stock: s.composite_score for s in session.query(CompositeScore)}
+        assert scores == {'AAPL': 60.0, 'MSFT': 70.0}
+        assert {d.stock: d.composite_score for d in session.query(DailyScore)} == scores
+
+        '''Old news land in one batch so they are summarized again'''
+        assert session.query(IngestBatch).count() == 1
+        assert session.query(News).filter(News.batch_id.is_(None)).count() == 0
+    engine.dispose()
+
+def test_sentiment_memo_and_stored_scores(tmp_path, monkeypatch):
+    """Test that repeated texts are scored once, across tickers and from stored scores."""
+    from backend import sentiment
+    from backend.database import init_db, session_scope
+    from backend.db_models import SentimentScore
+
+    scored = []
+    analyzer = FakeAnalyzer()
+    monkeypatch.setattr(analyzer, 'polarity_scores', lambda text: scored.append(text) or {'compound': 0.5})
+    monkeypatch.setattr(sentiment, '_analyzer', analyzer)
+    monkeypatch.setattr(sentiment, '_memo', sentiment.LRUCache(100))
+    engine = sentiment.SentimentEngine()
+
+    '''A syndicated headline filed under two tickers, once with different spacing'''
+    headline = 'Chip stocks rally on strong guidance'
+    assert engine.score_batch([headline, 'Other news', '  Chip stocks  rally on strong guidance']) == [0.5] * 3
+    assert engine.score_batch([headline]) == [0.5]
+    assert len(scored) == 2 and 'Other news' in scored
+
+    '''Scores stored by another process are used instead of scoring again'''
+    db = init_db(f"sqlite:///{tmp_path / 'scores.db'}")
+    sentiment.clear_memo()
+    with session_scope(db) as session:
+        session.add(SentimentScore(text_hash=sentiment.text_key('Stored text'), compound=-0.3))
+    with session_scope(db) as session:
+        assert engine.score_batch(['Stored text', 'New text'], session=session) == [-0.3, 0.5]
+    assert scored[2:] == ['New text']
+    with session_scope(db) as session:
+        assert session.get(SentimentScore, sentiment.text_key('New text')).compound == 0.5
+
+    '''Callers outside a session pass the stored scores in and write the new ones later'''
+    sentiment.clear_memo()
+    fresh = {}
+    stored = {sentiment.text_key('Stored text'): -0.3}
+    assert engine.score_batch(['Stored text', 'Late text'], stored=stored, fresh=fresh) == [-0.3, 0.5]
+    assert fresh == {sentiment.text_key('Late text'): 0.5}
+
+def test_backfill_sqlite_round_trip(tmp_path, monkeypatch):
+    """Test that backfilled news become summaries checked against the backfilled bars."""
+    import json
+    import sqlite3
+    from backend import sentiment
+    from backend.backfill import backfill
+
+    monkeypatch.setattr(sentiment, '_analyzer', FakeAnalyzer())
+    news = [
+        {'stock': 'aapl', 'title': 'Apple beats', 'summary': 'Strong quarter', 'published': '2024-03-04T10:00:00Z'},
+        {'stock': 'msft', 'title': 'Microsoft slips', 'summary': 'Weak cloud', 'published': '2024-03-05T11:00:00Z', 'guid': 'm-1'},
+        {'stock': 'msft', 'title': 'Microsoft slips', 'summary': 'Weak cloud', 'published': '2024-03-05T11:00:00Z', 'guid': 'm-1'}
+    ]
+    (tmp_path / 'news.jsonl').write_text(''.join(json.dumps(record) + '\n' for record in news))
+    (tmp_path / 'prices.csv').write_text(
+        'symbol,date,open,high,low,close,volume\n'
+        'AAPL,2024-03-04,100,106,99,105,1000\n'
+        'MSFT,2024-03-05,200,201,190,195,2000\n'
+    )
+
+    db_path = tmp_path / 'backfill.db'
+    counts = backfill(f'sqlite:///{db_path}', news_path=str(tmp_path / 'news.jsonl'),
+                      prices_path=str(tmp_path / 'prices.csv'))
+    assert counts == {'prices': 2, 'news': 2, 'summaries': 2, 'checked': 2}
+
+    db = sqlite3.connect(db_path)
+    try:
+        assert db.execute('SELECT stock, p_date FROM news ORDER BY stock').fetchall() == [
+            ('AAPL', 'AAPL_2024-03-04'), ('MSFT', 'MSFT_2024-03-05')
+        ]
+        summaries = db.execute('SELECT stock, open, close, high, low, volume, change FROM summary ORDER BY stock')
+        assert summaries.fetchall() == [
+            ('AAPL', 100.0, 105.0, 106.0, 99.0, 1000.0, 'win'),
+            ('MSFT', 200.0, 195.0, 201.0, 190.0, 2000.0, 'loss')
+        ]
+    finally:
+        db.close()
+
+    '''Loading the same files again adds nothing'''
+    counts = backfill(f'sqlite:///{db_path}', news_path=str(tmp_path / 'news.jsonl'),
+                      prices_path=str(tmp_path / 'prices.csv'))
+    assert counts['summaries'] == 0 and counts['checked'] == 0
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+
+CALENDAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'nyse_calendar.csv')
+
+'''Early closes are at 13:00 ET instead of 16:00'''
+EARLY_CLOSE_MINUTES = 180
+
+class TradingCalendar:
+    def __init__(self, closed, early_close=()):
+        """
+        Weekdays are sessions unless listed as closed
+        :param closed: iterable of dates the exchange is closed
+        :param early_close: iterable of dates the session ends early
+        """
+        self.closed = np.array(sorted(closed), dtype='datetime64[D]')
+        self.early_close = np.array(sorted(early_close), dtype='datetime64[D]')
+        self.busdaycal = np.busdaycalendar(weekmask='1111100', holidays=self.closed)
+
+    @classmethod
+    def from_file(cls, path=CALENDAR_FILE):
+        """
+        Read a date,status CSV where status is closed or early_close
+        :param path: File name
+        :return: TradingCalendar
+        """
+        closed, early_close = [], []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or line.startswith('date,'):
+                    continue
+                day, status = line.split(',')[:2]
+                (early_close if status.strip() == 'early_close' else closed).append(day)
+        return cls(closed, early_close)
+
+    def is_session(self, days):
+        """
+        :param days: array-like of dates
+        :return: bool array
+        """
+        return np.is_busday(np.asarray(days, dtype='datetime64[D]'), busdaycal=self.busdaycal)
+
+    def check_days(self, timestamps, closing_hour=20, closing_minute=0):
+        """
+        Session each timestamp's news is priced on, for a whole array at once. News after
+        the close, which is three hours earlier on early-close days, belong to the next session.
+        :param timestamps: array-like of datetimes, in the time zone of closing_hour
+        :param closing_hour: attach news for the next trading day after this
+        :param closing_minute: attach news for the next trading day after this
+        :return: datetime64[us] array, the timestamps moved forward by whole days
+        """
+        ts = np.asarray(timestamps, dtype='datetime64[us]')
+        days = ts.astype('datetime64[D]')
+        close = np.timedelta64(closing_hour * 60 + closing_minute, 'm') - np.where(
+            np.isin(days, self.early_close), np.timedelta64(EARLY_CLOSE_MINUTES, 'm'), np.timedelta64(0, 'm')
+        )
+        after_close = (ts - days) > close
+        sessions = np.busday_offset(days + after_close, 0, roll='forward', busdaycal=self.busdaycal)
+        return ts + (sessions - days)
+
+'''Loaded on first use, shared by the process'''
+_calendar = None
+
+def get_calendar():
+    """
+    Return the NYSE calendar read from CALENDAR_FILE
+    :return: TradingCalendar
+    """
+    global _calendar
+    if _calendar is None:
+        _calendar = TradingCalendar.from_file()
+    return _calendar
@@ -0,0 +1,250 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from .metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+
+'''Statuses worth retrying - the upstream is throttling us or struggling'''
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+'''Failures worth retrying, other request errors such as an invalid URL fail at once'''
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError
+)
+
+'''Default limits per upstream, FRED allows 120 requests a minute'''
+SERVICES = {
+    'yahoo': {'rate': 10, 'burst': 20, 'max_concurrency': 16},
+    'worldtradingdata': {'rate': 5, 'burst': 10, 'max_concurrency': 8},
+    'fred': {'rate': 2, 'burst': 5, 'max_concurrency': 4},
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Requests per second, None for no limit
+        :param burst: Requests allowed at once after a quiet period
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, rate or 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every request for a while, e.g. after a 429"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class AdaptiveLimiter:
+    def __init__(self, max_concurrency):
+        """
+        Caps requests in flight, halving the cap when the upstream pushes back
+        and growing it by one after a cap's worth of successes
+        :param max_concurrency: Upper bound on requests in flight
+        """
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+class UpstreamClient:
+    def __init__(self, service, rate=None, burst=None, max_concurrency=8,
+                 timeout=(5, 30), retries=4, backoff=0.5, max_backoff=30):
+        """
+        Pooled HTTP client for one upstream with rate limiting and retries
+        :param service: Name used in metrics, e.g. fred
+        :param rate: Requests per second, None for no limit
+        :param burst: Token bucket capacity
+        :param max_concurrency: Requests in flight and pooled connections
+        :param timeout: (connect, read) seconds
+        :param retries: Extra attempts on connection errors, 429 and 5xx
+        :param backoff: Base of the jittered exponential backoff in seconds
+        :param max_backoff: Longest wait between attempts
+        """
+        self.service = service
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    def get(self, url, params=None, headers=None):
+        """
+        GET with retries, the last response is returned even if it is an error
+        :raises requests.RequestException: if every attempt failed, or one failed in a way retrying cannot fix
+        :return: requests.Response
+        """
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            self.limiter.acquire()
+            response, error, retry = None, None, True
+            try:
+                with UPSTREAM_SECONDS.time(service=self.service):
+                    response = self.http.get(url, params=params, headers=headers, timeout=self.timeout)
+                retry = response.status_code in RETRY_STATUSES
+            except RETRY_ERRORS as e:
+                error = e
+            except requests.RequestException as e:
+                error, retry = e, False
+            finally:
+                self.limiter.release(throttled=retry)
+            UPSTREAM_REQUESTS.inc(
+                service=self.service,
+                outcome='error' if error is not None else str(response.status_code)
+            )
+
+            if not retry or attempt == self.retries:
+                break
+            delay = self._delay(attempt, response)
+            if response is not None and response.status_code == 429:
+                self.bucket.pause(delay)
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return response
+
+    def _delay(self, attempt, response):
+        """Retry-After if the upstream sent one, full-jitter exponential backoff otherwise"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, int(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+'''One client per upstream for the whole process'''
+_clients = {}
+_lock = threading.Lock()
+
+def _options(service):
+    """Defaults from SERVICES, the rate can be overridden with UPSTREAM_<SERVICE>_RATE"""
+    options = dict(SERVICES.get(service, {}))
+    rate = os.getenv(f'UPSTREAM_{service.upper()}_RATE')
+    if rate is not None:
+        options['rate'] = float(rate) or None
+    return options
+
+def get_client(service):
+    """
+    Return the shared client of an upstream
+    :param service: Key of SERVICES
+    :return: UpstreamClient
+    """
+    client = _clients.get(service)
+    if client is not None:
+        return client
+
+    with _lock:
+        if service not in _clients:
+            _clients[service] = UpstreamClient(service, **_options(service))
+        return _clients[service]
+
+def configure(service, **options):
+    """
+    Replace the shared client of an upstream, options as in UpstreamClient
+    :return: UpstreamClient
+    """
+    with _lock:
+        _clients[service] = UpstreamClient(service, **{**_options(service), **options})
+        return _clients[service]
+
+def clients():
+    """
+    The shared clients as they are now, see restore_clients
+    :return: Dictionary of service -> UpstreamClient
+    """
+    with _lock:
+        return dict(_clients)
+
+def restore_clients(saved):
+    """Put back the shared clients returned by clients(), dropping any configured since"""
+    with _lock:
+        _clients.clear()
+        _clients.update(saved)
+
+def limits():
+    """
+    Limits of every upstream as this process applies them, configured clients included
+    :return: Dictionary of service -> rate, burst and max_concurrency
+    """
+    result = {}
+    for service in {**SERVICES, **_clients}:
+        client = _clients.get(service)
+        if client is not None:
+            result[service] = {
+                'rate': client.bucket.rate,
+                'burst': client.bucket.capacity,
+                'max_concurrency': client.limiter.max_concurrency
+            }
+        else:
+            options = _options(service)
+            result[service] = {key: options.get(key) for key in ('rate', 'burst', 'max_concurrency')}
+    return result
+
+def split_limits(limits, shares):
+    """
+    Each process' part of the limits, so processes sharing an upstream stay under them together
+    :param limits: Dictionary as returned by limits()
+    :param shares: Number of processes
+    :return: Dictionary of service -> options for configure()
+    """
+    def part(value, minimum):
+        return None if value is None else max(minimum, value / shares)
+
+    return {service: {
+        'rate': part(options['rate'], 0),
+        'burst': part(options['burst'], 1),
+        'max_concurrency': max(1, (options['max_concurrency'] or 8) // shares)
+    } for service, options in limits.items()}
+
+def reset_clients():
+    """Forget clients inherited from a parent process, their pooled sockets are shared"""
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import { fetchCompositeScores } from '../services/api';
+import { fetchCompositeScores, subscribeScores } from '../services/api';
 import { useNavigate } from 'react-router-dom';
 import Header from '../components/Header';
 import DataCard from '../components/DataCard';
@@ -25,6 +25,12 @@ export default function AnalysisPage() {
       setLoading(false);
     };
     loadData();
+
+    // New scores are pushed by the server, no need to poll
+    return subscribeScores((update) => {
+      setScores(update.scores);
+      setLoading(false);
+    });
   }, []);
 
   return (
@@ -1,13 +1,23 @@
 import React from 'react';
 import { useNavigate, Link } from 'react-router-dom';
 import { Container } from '@mui/material';
-import { runAnalysis } from '../services/api';
+import { runAnalysis, fetchJob } from '../services/api';
 import PageLayout from '../components/PageLayout';
 import Intro from '../components/Intro';
 import StockGrid from '../components/StockGrid';
 import CTACard from '../components/CTACard';
 
 const MAG7_STOCKS = ['AAPL', 'MSFT', 'NVDA', 'META', 'TSLA', 'AMZN', 'GOOG'];
+const JOB_POLL_MS = 2000;
+
+const waitForJob = async (jobId) => {
+  while (true) {
+    const { data } = await fetchJob(jobId);
+    if (data.status === 'succeeded') return data;
+    if (data.status === 'failed') throw new Error(data.error);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+  }
+};
 
 export default function Dashboard() {
   const navigate = useNavigate();
@@ -16,7 +26,8 @@ export default function Dashboard() {
   const handleRunAnalysis = async () => {
     setLoading(true);
     try {
-      await runAnalysis(MAG7_STOCKS);
+      const { data } = await runAnalysis(MAG7_STOCKS);
+      await waitForJob(data.job_id);
       navigate('/analyse');
     } catch (error) {
       console.error('Analysis failed:', error);
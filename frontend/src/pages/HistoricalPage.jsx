@@ -5,7 +5,7 @@ import { Typography } from '@mui/material';
 import Header from '../components/Header';
 import DataCard from '../components/DataCard';
 import GridContainer from '../components/GridContainer';
-import { fetchHistoricalData } from '../services/api';
+import { fetchHistoricalData, subscribeScores } from '../services/api';
 import PageLayout from '../components/PageLayout';
 import LoadingOverlay from '../components/LoadingOverlay';
 import ContentContainer from '../components/ContentContainer';
@@ -26,6 +26,14 @@ export default function HistoricalPage() {
       setLoading(false);
     };
     loadData();
+
+    // Replace the pushed day's point for this stock, the list is newest first
+    return subscribeScores((update) => {
+      const latest = update.scores.find((score) => score.stock === stock);
+      if (!latest) return;
+      setHistoricalData((days) => [latest, ...days.filter((day) => day.date !== latest.date)]
+        .sort((a, b) => b.date.localeCompare(a.date)));
+    });
   }, [stock]);
 
   return (
@@ -5,10 +5,17 @@ const api = axios.create({
 });
 
 export const runAnalysis = (stocks) => api.post('/run-analysis', { stocks });
+export const fetchJob = (jobId) => api.get(`/jobs/${jobId}`);
 export const fetchCompositeScores = () => api.get('/composite-score');
 export const fetchHistoricalData = (stock) => 
   api.get('/historical-scores', { 
     params: { 
       stock: stock
     } 
-  });
\ No newline at end of file
+  });
+
+export const subscribeScores = (onScores) => {
+  const source = new EventSource(`${api.defaults.baseURL}/stream/scores`);
+  source.addEventListener('scores', (event) => onScores(JSON.parse(event.data)));
+  return () => source.close();
+};
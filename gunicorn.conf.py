@@ -0,0 +1,26 @@
+"""
+gunicorn settings, read when gunicorn is started from the repository root
+
+    gunicorn "backend.app:create_app()"
+"""
+import os
+
+'''Threaded workers - an open /stream/scores connection holds one thread, not the whole worker,
+and the worker keeps notifying the arbiter while it streams, so the timeout does not kill it'''
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+
+def on_starting(server):
+    '''Migrate the schema once in the arbiter, workers starting together then find nothing to do'''
+    from sqlalchemy import create_engine
+    from backend.app import database_url
+    from backend.migrations import upgrade
+
+    engine = create_engine(database_url())
+    try:
+        upgrade(engine)
+    finally:
+        engine.dispose()